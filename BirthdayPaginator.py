@@ -1,86 +1,167 @@
 from discord import Embed, ButtonStyle, Interaction
-from discord.ui import View, Button
+from discord.ui import View, Button, DynamicItem
+from datetime import datetime
+import asyncio
 import discord
 import re
-from datetime import datetime
+import database as db
+from cache import AsyncTTLCache
+from members import resolve_members
 
 ITEMS_PER_PAGE = 15
+RECONNECT_DELAY = 5
+
+# Pages récemment affichées (avec le nombre total d'anniversaires lu en même temps), partagées par tous
+# les paginateurs (taille bornée, indépendante du nombre de messages). Chaque écriture en base notifie
+# le serveur modifié (NOTIFY guild_birthdays_changed, voir db.notify_birthdays_changed), y compris depuis
+# le dashboard : ses pages sont invalidées. Tant que l'écoute n'est pas active, le cache est contourné.
+page_cache = AsyncTTLCache(ttl=60, maxsize=256)
+_listening = False
+_listener = None
+
+# Les boutons sont persistants et sans état : tout ce qu'il faut pour afficher la page voisine
+# (serveur, numéro de page, date de référence, curseur) est encodé dans leur custom_id.
+CURSOR_PATTERN = r'(?P<guild_id>\d+):(?P<page>\d+):(?P<today>\d{8}):(?P<wrapped>[01]):(?P<key>\d+):(?P<member_id>\d+)'
 
 def escape_markdown(text: str) -> str:
     # Échapper les caractères Markdown communs
     return re.sub(r'([*_~`>])', r'\\\1', text)
 
-class BirthdayPaginator(View):
-    def __init__(self, ctx, birthdays):
-        super().__init__(timeout=180)
-        self.ctx = ctx
-        self.birthdays = list(birthdays.items())
-        self.current_page = 0
-        self.max_page = (len(self.birthdays) - 1) // ITEMS_PER_PAGE
-
-        # Initialiser les boutons désactivés si nécessaire
-        if self.max_page == 0:
-            self.previous_button.disabled = True
-            self.next_button.disabled = True
+def cursor_of(entry):
+    return (entry['wrapped'], entry['birthday_key'], entry['member_id'])
+
+def _on_notify(payload):
+    try:
+        guild_id = int(payload)
+    except ValueError:
+        print(f"Notification d'anniversaires invalide ignorée : {payload!r}", flush=True)
+        return
+    page_cache.invalidate_where(lambda key: key[0] == guild_id)
+
+def _on_lost():
+    global _listening
+    # Des notifications ont pu être manquées : plus aucune page n'est fiable
+    _listening = False
+    page_cache.invalidate_where(lambda key: True)
+    print("Écoute des anniversaires perdue, reconnexion...", flush=True)
+    asyncio.get_running_loop().create_task(start_listening())
+
+async def start_listening():
+    """Ouvre la connexion d'écoute, en réessayant jusqu'au succès."""
+    global _listening, _listener
+    while True:
+        try:
+            _listener = await db.listen(db.BIRTHDAYS_CHANNEL, _on_notify, _on_lost)
+            break
+        except Exception as e:
+            print(f"Écoute des anniversaires impossible, retry dans {RECONNECT_DELAY}s... Erreur: {e}", flush=True)
+            await asyncio.sleep(RECONNECT_DELAY)
+    # Les modifications faites avant l'ouverture de l'écoute n'ont pas été notifiées
+    page_cache.invalidate_where(lambda key: True)
+    _listening = True
+    print("Écoute des modifications d'anniversaires active.", flush=True)
+
+# (nombre total d'anniversaires du serveur, entrées de la page)
+async def fetch_page(guild_id, today, after=None, before=None):
+    async def load():
+        total = await db.count_guild_birthdays(guild_id)
+        entries = await db.get_upcoming_birthdays_page(guild_id, today, after=after, before=before, limit=ITEMS_PER_PAGE)
+        return total, entries
+
+    if not _listening:
+        return await load()
+    return await page_cache.get_or_fetch((guild_id, today, after, before), load)
+
+def build_embed(members, entries, page, max_page):
+    embed = Embed(
+        title="🎂 Anniversaires enregistrés",
+        description=f"Page {page+1}/{max_page+1} — par prochain anniversaire",
+        color=0xFFC0CB
+    )
+
+    for entry in entries:
+        member_id = entry['member_id']
+        member = members.get(member_id)
+
+        # Fallback si membre absent
+        if member:
+            member_name = f"{member.display_name} ({member.name})"
+            safe_name = escape_markdown(member_name)
         else:
-            self.previous_button.disabled = True  # page 0 = début
-            self.next_button.disabled = False     # il y a une page suivante
-            
-            
-    def get_embed(self):
-        start = self.current_page * ITEMS_PER_PAGE
-        end = start + ITEMS_PER_PAGE
-        entries = self.birthdays[start:end]
-
-        embed = Embed(
-            title="🎂 Anniversaires enregistrés",
-            description=f"Page {self.current_page+1}/{self.max_page+1}",
-            color=0xFFC0CB
+            safe_name = f"({member_id})"
+
+        # Formater la date
+        formatted_date = entry['birthday_date'].strftime("%d/%m/%Y")
+
+        embed.add_field(
+            name=safe_name,
+            value=formatted_date,
+            inline=False
         )
 
-        for member_id, birthday_date in entries:
-            member = self.ctx.guild.get_member(int(member_id))
-            
-            # Fallback si membre absent
-            if member:
-                member_name = f"{member.display_name} ({member.name})"
-                safe_name = escape_markdown(member_name)
-            else:
-                safe_name = f"({member_id})"
-
-            # Formater la date
-            dt = datetime.strptime(birthday_date, "%Y-%m-%d")
-            formatted_date = dt.strftime("%d/%m/%Y")
-            
-            embed.add_field(
-                name=safe_name,
-                value=formatted_date,
-                inline=False
-            )
-
-        return embed
-
-
-    @discord.ui.button(label="◀", style=ButtonStyle.secondary)
-    async def previous_button(self, interaction: Interaction, button: Button):
-        if self.current_page > 0:
-            self.current_page -= 1
-        # mettre à jour disabled
-        self.previous_button.disabled = self.current_page == 0
-        self.next_button.disabled = False
-        await interaction.response.edit_message(embed=self.get_embed(), view=self)
-
-    @discord.ui.button(label="▶", style=ButtonStyle.secondary)
-    async def next_button(self, interaction: Interaction, button: Button):
-        if self.current_page < self.max_page:
-            self.current_page += 1
-        # mettre à jour disabled
-        self.next_button.disabled = self.current_page == self.max_page
-        self.previous_button.disabled = False
-        await interaction.response.edit_message(embed=self.get_embed(), view=self)
-
-    @discord.ui.button(label="❌", style=ButtonStyle.danger)
-    async def close_button(self, interaction: Interaction, button: Button):
-        # Supprime le message et stoppe la view
+    return embed
+
+# Construit l'embed et les boutons d'une page ; page 0 si `after`/`before` sont absents
+async def render_page(guild, guild_id, today, page, after=None, before=None):
+    total, entries = await fetch_page(guild_id, today, after, before)
+    max_page = max(0, (total - 1) // ITEMS_PER_PAGE)
+
+    # La liste a pu changer depuis l'affichage (suppressions) : on repart de la première page
+    if not entries or page > max_page:
+        page = 0
+        total, entries = await fetch_page(guild_id, today)
+        max_page = max(0, (total - 1) // ITEMS_PER_PAGE)
+
+    members = await resolve_members(guild, [entry['member_id'] for entry in entries]) if guild else {}
+    view = BirthdayPaginator(guild_id, today, page, max_page, entries)
+    return build_embed(members, entries, page, max_page), view
+
+class BirthdayPaginator(View):
+    def __init__(self, guild_id, today, page, max_page, entries):
+        super().__init__(timeout=None)
+        first = cursor_of(entries[0]) if entries else (False, 0, 0)
+        last = cursor_of(entries[-1]) if entries else (False, 0, 0)
+
+        self.add_item(BirthdayPageButton('prev', guild_id, page - 1, today, first, disabled=page == 0))
+        self.add_item(BirthdayPageButton('next', guild_id, page + 1, today, last, disabled=page >= max_page))
+        self.add_item(BirthdayCloseButton())
+
+class BirthdayPageButton(DynamicItem[Button], template=r'anniv:(?P<direction>prev|next):' + CURSOR_PATTERN):
+    def __init__(self, direction, guild_id, page, today, cursor, disabled=False):
+        wrapped, key, member_id = cursor
+        super().__init__(Button(
+            label="◀" if direction == 'prev' else "▶",
+            style=ButtonStyle.secondary,
+            disabled=disabled,
+            custom_id=f"anniv:{direction}:{guild_id}:{max(page, 0)}:{today:%Y%m%d}:{int(wrapped)}:{key}:{member_id}",
+        ))
+        self.direction = direction
+        self.guild_id = guild_id
+        self.page = max(page, 0)
+        self.today = today
+        self.cursor = (bool(wrapped), key, member_id)
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: Button, match: re.Match[str]):
+        cursor = (match['wrapped'] == '1', int(match['key']), int(match['member_id']))
+        today = datetime.strptime(match['today'], "%Y%m%d").date()
+        return cls(match['direction'], int(match['guild_id']), int(match['page']), today, cursor)
+
+    async def callback(self, interaction: Interaction):
+        if self.direction == 'prev':
+            embed, view = await render_page(interaction.guild, self.guild_id, self.today, self.page, before=self.cursor)
+        else:
+            embed, view = await render_page(interaction.guild, self.guild_id, self.today, self.page, after=self.cursor)
+        await interaction.response.edit_message(embed=embed, view=view)
+
+class BirthdayCloseButton(DynamicItem[Button], template=r'anniv:close'):
+    def __init__(self):
+        super().__init__(Button(label="❌", style=ButtonStyle.danger, custom_id="anniv:close"))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: Button, match: re.Match[str]):
+        return cls()
+
+    async def callback(self, interaction: Interaction):
+        # Supprime le message
         await interaction.message.delete()
-        self.stop()
\ No newline at end of file
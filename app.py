@@ -1,13 +1,44 @@
 # app.py
-from datetime import datetime
-from quart import Quart, redirect, url_for, session, request, render_template, jsonify
-import requests
+from datetime import datetime, timedelta
+from quart import Quart, Response, redirect, url_for, session, request, render_template, jsonify, make_response
+import aiohttp
+import csv
+import io
+import json
 import os
 import asyncio
+import time
+from zoneinfo import ZoneInfo, available_timezones
 import database as db
+import metrics
+from cache import AsyncTTLCache
+import sessions
 
 app = Quart(__name__)
-app.secret_key = os.urandom(24)
+
+# Sessions stockées en base (voir sessions.py). SECRET_KEY doit être identique pour tous les workers
+# et stable d'un déploiement à l'autre ; SECRET_KEY_FALLBACKS (séparées par des virgules) : anciennes
+# clés encore acceptées pendant une rotation.
+app.secret_key = os.getenv('SECRET_KEY')
+if not app.secret_key:
+    print("SECRET_KEY non défini : clé aléatoire, les sessions seront perdues au redémarrage.", flush=True)
+    app.secret_key = os.urandom(24)
+app.config['SECRET_KEY_FALLBACKS'] = [k for k in os.getenv('SECRET_KEY_FALLBACKS', '').split(',') if k]
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=int(os.getenv('SESSION_LIFETIME_DAYS', '7')))
+app.config['SESSION_COOKIE_SECURE'] = os.getenv('SESSION_COOKIE_SECURE', '0') == '1'
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.session_interface = sessions.PostgresSessionInterface(
+    skip_prefixes=(f'{app.static_url_path}/', '/metrics', '/healthz', '/readyz')
+)
+SESSION_PURGE_INTERVAL = 3600
+session_purge_task = None
+
+# Connexion à la base en arrière-plan (voir keep_db_connected) ; délais entre deux essais (secondes)
+DB_RETRY_MIN_DELAY = 1
+DB_RETRY_MAX_DELAY = 30
+db_connect_task = None
+# Routes servies même sans base de données
+DB_FREE_ENDPOINTS = {'healthz', 'readyz', 'static', 'metrics_endpoint'}
 
 # Config Discord
 DISCORD_CLIENT_ID = os.getenv('DISCORD_CLIENT_ID')
@@ -15,15 +46,302 @@ DISCORD_CLIENT_SECRET = os.getenv('DISCORD_CLIENT_SECRET')
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 REDIRECT_URI = os.getenv('REDIRECT_URI')
 
-API_ENDPOINT = 'https://discord.com/api/v10'
+API_ENDPOINT = os.getenv('DISCORD_API_ENDPOINT', 'https://discord.com/api/v10')
+
+# Client HTTP partagé (connexions keep-alive), créé au démarrage du serveur
+HTTP_TIMEOUT = float(os.getenv('DISCORD_HTTP_TIMEOUT', '10'))
+HTTP_POOL_SIZE = int(os.getenv('DISCORD_HTTP_POOL_SIZE', '100'))
+http_session: aiohttp.ClientSession | None = None
+
+# API interne du bot (cache de la gateway), utilisée en priorité avant l'API REST de Discord.
+# Une seule URL : avec plusieurs process bot (launcher.py), seul celui-ci est interrogé ; il répond 404
+# pour les serveurs des autres shards, servis alors par l'API REST
+BOT_INTERNAL_URL = os.getenv('BOT_INTERNAL_URL', '').rstrip('/')
+INTERNAL_API_TOKEN = os.getenv('INTERNAL_API_TOKEN', '')
+BOT_INTERNAL_TIMEOUT = float(os.getenv('BOT_INTERNAL_TIMEOUT', '2'))
+RECONCILE_TIMEOUT = float(os.getenv('RECONCILE_TIMEOUT', '120'))
+
+# Fuseaux horaires proposés dans le formulaire
+TIMEZONES = sorted(available_timezones())
+
+# Pagination des membres (1000 = maximum autorisé par Discord)
+MEMBERS_PAGE_SIZE = 1000
+MEMBERS_MAX_PER_PAGE = 200
+# Anniversaires lus par pages de BIRTHDAYS_PAGE_SIZE pour la liste des membres
+BIRTHDAYS_PAGE_SIZE = 5000
+# Au-delà (secondes), la liste des membres est servie à partir des seuls anniversaires enregistrés ;
+# le chargement des membres continue en arrière-plan et alimente le cache pour les requêtes suivantes
+MEMBERS_LOAD_TIMEOUT = float(os.getenv('MEMBERS_LOAD_TIMEOUT', '3'))
+
+# Calendrier des prochains anniversaires
+CALENDAR_MAX_DAYS = 365
+CALENDAR_MAX_LIMIT = 500
+
+# Taille maximale d'un lot de modifications envoyé par le dashboard
+BATCH_MAX_CHANGES = 1000
+
+# Serveurs administrés par l'utilisateur, gardés dans sa session (secondes)
+USER_GUILDS_TTL = float(os.getenv('USER_GUILDS_TTL', '60'))
+# Le jeton OAuth est renouvelé s'il expire dans moins de TOKEN_REFRESH_MARGIN secondes
+TOKEN_REFRESH_MARGIN = 60
+
+# Cache des métadonnées Discord (liste des serveurs du bot, rôles, salons, infos serveur) et des listes
+# de membres fusionnées avec les anniversaires
+discord_cache = AsyncTTLCache(
+    ttl=float(os.getenv('DISCORD_CACHE_TTL', '60')),
+    maxsize=int(os.getenv('DISCORD_CACHE_SIZE', '1024')),
+)
+# Écoute des modifications d'anniversaires (NOTIFY guild_birthdays_changed, envoyé par toute écriture en
+# base, quel que soit le worker ou le bot) : la liste fusionnée du serveur est invalidée à la réception.
+# Tant que l'écoute n'est pas active, cette liste n'est pas mise en cache.
+birthdays_listening = False
+birthdays_listener = None
 
 # --- Fonctions utilitaires ---
-async def get_bot_guilds():
+def create_http_session():
+    return aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=30),
+    )
+
+async def discord_request(method, path, headers, **kwargs):
+    with metrics.discord_call('web', f'{method} {path}'):
+        async with http_session.request(method, f'{API_ENDPOINT}{path}', headers=headers, **kwargs) as resp:
+            data = await resp.json(content_type=None)
+    if resp.status == 429:
+        metrics.rate_limited('web')
+    return resp.status, data
+
+async def discord_get(path, headers, **kwargs):
+    status, data = await discord_request('GET', path, headers, **kwargs)
+    if status != 200:
+        raise Exception(f"Discord a répondu {status} pour {path}")
+    return data
+
+# Appel à l'API interne du bot : (statut, données), ou (None, None) si elle n'est pas configurée ou injoignable
+async def bot_internal_request(method, path, timeout=BOT_INTERNAL_TIMEOUT):
+    if not BOT_INTERNAL_URL or not INTERNAL_API_TOKEN:
+        return None, None
+    try:
+        async with http_session.request(
+            method,
+            f'{BOT_INTERNAL_URL}{path}',
+            headers={'Authorization': f'Bearer {INTERNAL_API_TOKEN}'},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            data = await resp.json(content_type=None) if resp.status != 404 else None
+            if resp.status not in (200, 404):
+                print(f"API interne du bot : réponse {resp.status} pour {method} {path}", flush=True)
+            return resp.status, data
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"API interne du bot injoignable ({method} {path}): {e!r}", flush=True)
+        return None, None
+
+# Données servies par le bot depuis son cache, ou None (API interne non configurée, injoignable,
+# ou donnée absente de ce cache) : l'appelant se replie alors sur l'API REST de Discord
+async def bot_internal_get(path):
+    status, data = await bot_internal_request('GET', path)
+    return data if status == 200 else None
+
+# Ressource d'un serveur (rôles, salons, infos) : cache du bot, sinon API REST, mise en cache
+async def get_guild_resource(guild_id, resource, path):
+    async def load():
+        data = await bot_internal_get(path)
+        if data is None:
+            data = await discord_get(path, {'Authorization': f'Bot {DISCORD_TOKEN}'})
+        return data
+
+    return await discord_cache.get_or_fetch((guild_id, resource), load)
+
+# Parcourt tous les membres d'un serveur page par page (curseur `after`), au fur et à mesure des réponses
+async def iter_guild_members(guild_id):
     headers = {'Authorization': f'Bot {DISCORD_TOKEN}'}
-    resp = requests.get(f'{API_ENDPOINT}/users/@me/guilds', headers=headers)
-    if resp.status_code == 200:
-        return [int(g['id']) for g in resp.json()]
-    return []
+    after = 0
+    while True:
+        page = await discord_get(f'/guilds/{guild_id}/members', headers, params={'limit': MEMBERS_PAGE_SIZE, 'after': after})
+        if page:
+            yield page
+        if len(page) < MEMBERS_PAGE_SIZE:
+            return
+        after = page[-1]['user']['id']
+
+# Liste compacte des membres (hors bots) d'un serveur, mise en cache
+async def get_guild_members(guild_id):
+    async def load():
+        members = await bot_internal_get(f'/guilds/{guild_id}/members')
+        if members is not None:
+            return members
+
+        members = []
+        async for page in iter_guild_members(guild_id):
+            for m in page:
+                user = m.get('user', {})
+                if not user.get('bot', False):
+                    members.append({"id": user['id'], "username": user.get('username'), "avatar": user.get('avatar')})
+        return members
+
+    return await discord_cache.get_or_fetch((guild_id, 'members'), load)
+
+# Tous les anniversaires d'un serveur (membres partis compris) : {member_id: "YYYY-MM-DD"}
+async def get_guild_birthdays(guild_id):
+    birthdays = {}
+    after = 0
+    while True:
+        page = await db.get_guild_birthdays_page(guild_id, after, BIRTHDAYS_PAGE_SIZE)
+        birthdays.update((str(member_id), str(birthday_date)) for member_id, birthday_date in page)
+        if len(page) < BIRTHDAYS_PAGE_SIZE:
+            return birthdays
+        after = page[-1][0]
+
+# Membres du serveur avec leur anniversaire, suivis des membres partis ayant encore un anniversaire enregistré
+def merge_member_rows(members, birthdays):
+    rows = [dict(m, birthday=birthdays.get(m['id']), left=False) for m in members]
+    present_ids = {m['id'] for m in members}
+    for user_id, birthday in birthdays.items():
+        if user_id not in present_ids:
+            rows.append({"id": user_id, "username": None, "avatar": None, "birthday": birthday, "left": True})
+    return rows
+
+# Liste fusionnée, mise en cache (voir birthdays_listening)
+async def get_member_rows(guild_id):
+    async def load():
+        members, birthdays = await asyncio.gather(get_guild_members(guild_id), get_guild_birthdays(guild_id))
+        return merge_member_rows(members, birthdays)
+
+    if not birthdays_listening:
+        return await load()
+    return await discord_cache.get_or_fetch((guild_id, 'member_rows'), load)
+
+# Liste des membres indisponible : anniversaires enregistrés seuls, présence des membres inconnue
+def birthday_only_rows(birthdays):
+    return [
+        {"id": user_id, "username": None, "avatar": None, "birthday": birthday, "left": None}
+        for user_id, birthday in birthdays.items()
+    ]
+
+# Anniversaires d'un serveur modifiés par ce worker : invalidation immédiate, sans attendre la notification
+def birthdays_changed(guild_id):
+    discord_cache.invalidate((int(guild_id), 'member_rows'))
+
+def on_birthdays_notify(payload):
+    try:
+        guild_id = int(payload)
+    except ValueError:
+        print(f"Notification d'anniversaires invalide ignorée : {payload!r}", flush=True)
+        return
+    discord_cache.invalidate((guild_id, 'member_rows'))
+
+def on_birthdays_listener_lost():
+    global birthdays_listening
+    # Des notifications ont pu être manquées : plus aucune liste n'est fiable
+    birthdays_listening = False
+    discord_cache.invalidate_where(lambda key: key[1:] == ('member_rows',))
+    print("Écoute des anniversaires perdue, reconnexion...", flush=True)
+    asyncio.get_running_loop().create_task(listen_birthday_changes())
+
+async def listen_birthday_changes():
+    global birthdays_listening, birthdays_listener
+    while True:
+        try:
+            birthdays_listener = await db.listen(db.BIRTHDAYS_CHANNEL, on_birthdays_notify, on_birthdays_listener_lost)
+            break
+        except Exception as e:
+            print(f"Écoute des anniversaires impossible, retry dans {DB_RETRY_MAX_DELAY}s... Erreur: {e}", flush=True)
+            await asyncio.sleep(DB_RETRY_MAX_DELAY)
+    # Les modifications faites avant l'ouverture de l'écoute n'ont pas été notifiées
+    discord_cache.invalidate_where(lambda key: key[1:] == ('member_rows',))
+    birthdays_listening = True
+
+async def get_bot_guilds():
+    async def load():
+        data = await bot_internal_get('/guilds')
+        if data is None:
+            data = await discord_get('/users/@me/guilds', {'Authorization': f'Bot {DISCORD_TOKEN}'})
+        return data
+
+    try:
+        data = await discord_cache.get_or_fetch(('bot_guilds',), load)
+    except Exception as e:
+        print(f"Erreur lors de la récupération des serveurs du bot: {e}", flush=True)
+        return []
+    return [int(g['id']) for g in data]
+
+# --- Compte Discord de l'utilisateur (jetons OAuth et serveurs gardés dans la session) ---
+async def request_token(grant):
+    """Échange un code d'autorisation ou un refresh_token ; True si la session a reçu un nouveau jeton."""
+    data = {'client_id': DISCORD_CLIENT_ID, 'client_secret': DISCORD_CLIENT_SECRET, **grant}
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    status, token_data = await discord_request('POST', '/oauth2/token', headers, data=data)
+    if status != 200 or 'access_token' not in token_data:
+        print(f"Échec de l'obtention du jeton OAuth ({grant['grant_type']}) : réponse {status}", flush=True)
+        return False
+    session['access_token'] = token_data['access_token']
+    session['refresh_token'] = token_data.get('refresh_token', session.get('refresh_token'))
+    session['token_expires_at'] = time.time() + token_data.get('expires_in', 0)
+    return True
+
+# Jeton d'accès de l'utilisateur, renouvelé avant son expiration ; None s'il faut se reconnecter
+async def user_access_token():
+    if 'access_token' not in session:
+        return None
+    if time.time() < session.get('token_expires_at', 0) - TOKEN_REFRESH_MARGIN:
+        return session['access_token']
+    if not session.get('refresh_token'):
+        return None
+    if not await request_token({'grant_type': 'refresh_token', 'refresh_token': session['refresh_token']}):
+        return None
+    return session['access_token']
+
+# Serveurs dont l'utilisateur est administrateur, relus sur Discord au plus une fois par USER_GUILDS_TTL ;
+# None s'il faut se reconnecter
+async def get_user_admin_guilds():
+    cached = session.get('admin_guilds')
+    if cached is not None and time.time() < session.get('admin_guilds_at', 0) + USER_GUILDS_TTL:
+        return cached
+
+    token = await user_access_token()
+    if token is None:
+        return None
+    status, user_guilds = await discord_request('GET', '/users/@me/guilds', {'Authorization': f'Bearer {token}'})
+    if status == 401:
+        return None
+    if status != 200:
+        # Limite de débit ou erreur Discord : la liste précédente reste utilisable
+        if cached is not None:
+            return cached
+        raise Exception(f"Discord a répondu {status} pour /users/@me/guilds")
+
+    admin_guilds = [
+        {"id": g['id'], "name": g['name'], "icon": g.get('icon')}
+        for g in user_guilds
+        if (int(g.get('permissions', 0)) & 8) == 8
+    ]
+    session['admin_guilds'] = admin_guilds
+    session['admin_guilds_at'] = time.time()
+    return admin_guilds
+
+# Accès aux pages et à l'API d'un serveur : réservé à ses administrateurs (liste gardée dans la session).
+# Retourne 200, 401 (connexion requise ou expirée), 403 (pas administrateur) ou 502 (Discord injoignable).
+async def guild_admin_status(guild_id):
+    if 'user' not in session:
+        return 401
+    try:
+        admin_guilds = await get_user_admin_guilds()
+    except Exception as e:
+        print(f"Erreur lors de la récupération des serveurs de l'utilisateur: {e}", flush=True)
+        return 502
+    if admin_guilds is None:
+        return 401
+    return 200 if str(guild_id) in {g['id'] for g in admin_guilds} else 403
+
+GUILD_ACCESS_ERRORS = {
+    401: "Authentification requise",
+    403: "Accès refusé : tu n'es pas administrateur de ce serveur",
+    502: "Impossible de vérifier tes serveurs Discord",
+}
+
+def guild_access_error(status):
+    return jsonify({"success": False, "error": GUILD_ACCESS_ERRORS[status]}), status
 
 # --- Routes ---
 @app.route('/')
@@ -39,29 +357,27 @@ async def login():
 @app.route('/callback')
 async def callback():
     code = request.args.get('code')
-    data = {
-        'client_id': DISCORD_CLIENT_ID,
-        'client_secret': DISCORD_CLIENT_SECRET,
+    session.clear()
+    await sessions.regenerate(session)
+    granted = await request_token({
         'grant_type': 'authorization_code',
         'code': code,
         'redirect_uri': REDIRECT_URI,
         'scope': 'identify guilds'
-    }
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    response = requests.post(f'{API_ENDPOINT}/oauth2/token', data=data, headers=headers)
-    token_data = response.json()
-    session['access_token'] = token_data['access_token']
+    })
+    if not granted:
+        session.clear()
+        return redirect(url_for('index'))
 
     user_headers = {'Authorization': f'Bearer {session["access_token"]}'}
-    user_response = requests.get(f'{API_ENDPOINT}/users/@me', headers=user_headers)
-    session['user'] = user_response.json()
-    
+    _, session['user'] = await discord_request('GET', '/users/@me', user_headers)
+
     return redirect(url_for('dashboard'))
 
 @app.route('/logout')
 async def logout():
-    session.pop('user', None)
-    session.pop('access_token', None)
+    # Session vidée : supprimée en base et cookie effacé
+    session.clear()
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
@@ -69,66 +385,27 @@ async def dashboard():
     if 'user' not in session or 'access_token' not in session:
         return redirect(url_for('index'))
 
-    user_headers = {'Authorization': f'Bearer {session["access_token"]}'}
-    guilds_response = requests.get(f'{API_ENDPOINT}/users/@me/guilds', headers=user_headers)
-    user_guilds = guilds_response.json()
-
-    bot_guild_ids = await get_bot_guilds()
+    user_guilds = await get_user_admin_guilds()
+    if user_guilds is None:
+        # Jeton expiré ou révoqué : nouvelle connexion
+        session.clear()
+        return redirect(url_for('login'))
 
-    admin_guilds = []
-    for guild in user_guilds:
-        is_admin = (int(guild.get('permissions', 0)) & 8) == 8
-        is_bot_in_guild = int(guild.get('id')) in bot_guild_ids
-        if is_admin and is_bot_in_guild:
-            admin_guilds.append(guild)
+    bot_guild_ids = set(await get_bot_guilds())
+    admin_guilds = [guild for guild in user_guilds if int(guild['id']) in bot_guild_ids]
 
     return await render_template('dashboard.html', user=session['user'], guilds=admin_guilds)
 
 
 @app.route('/server/<int:guild_id>', methods=['GET', 'POST'])
 async def server_config(guild_id):
-    if 'user' not in session:
+    status = await guild_admin_status(guild_id)
+    if status == 401:
         return redirect(url_for('index'))
-    
-    current_settings = await db.get_guild_settings(guild_id)
-
-    bot_headers = {'Authorization': f'Bot {DISCORD_TOKEN}'}
-    
-    # Récupération des rôles
-    roles_resp = requests.get(f'{API_ENDPOINT}/guilds/{guild_id}/roles', headers=bot_headers)
-    roles = roles_resp.json() if roles_resp.status_code == 200 else []
-
-    # Récupération des salons (texte uniquement)
-    channels_resp = requests.get(f'{API_ENDPOINT}/guilds/{guild_id}/channels', headers=bot_headers)
-    channels = [c for c in channels_resp.json() if c['type'] == 0] if channels_resp.status_code == 200 else []
-
-    # Infos serveur
-    guild_resp = requests.get(f'{API_ENDPOINT}/guilds/{guild_id}', headers=bot_headers)
-    guild_name = guild_resp.json().get('name', 'Serveur inconnu')
-
-    # Membres (max 1000, hors bots)
-    members_resp = requests.get(f'{API_ENDPOINT}/guilds/{guild_id}/members?limit=1000', headers=bot_headers)
-    all_members = members_resp.json() if members_resp.status_code == 200 else []
-    non_bot_members = [m for m in all_members if not m.get('user', {}).get('bot', False)]
-
-    # Anniversaires stockés en DB
-    all_birthdays = await db.get_all_guild_birthdays(guild_id)
-    all_birthdays_str_keys = {str(k): v for k, v in all_birthdays.items()}
-
-    # Fusion des membres avec ceux de la DB (pour inclure ceux qui ont quitté)
-    members_dict = {m["user"]["id"]: m for m in non_bot_members}
-
-    for user_id, birthday in all_birthdays_str_keys.items():
-        if user_id not in members_dict:
-            members_dict[user_id] = {
-                "user": {
-                    "id": user_id,
-                    "username": f"Utilisateur quitté ({user_id})",
-                    "avatar": None
-                }
-            }
-
-    final_members = list(members_dict.values())
+    if status != 200:
+        if request.method == 'POST':
+            return guild_access_error(status)
+        return GUILD_ACCESS_ERRORS[status], status
 
     # Gestion POST
     if request.method == 'POST':
@@ -136,28 +413,186 @@ async def server_config(guild_id):
         role_id = data.get('role_id')           # pas obligatoire
         channel_id = data.get('channel_id')     # obligatoire
         message = data.get('message')           # obligatoire avec "@membres"
+        timezone = data.get('timezone') or db.DEFAULT_TIMEZONE
 
         # Vérifications côté serveur
         if not channel_id:
             return jsonify({"success": False, "error": "Le canal est obligatoire"}), 400
         if "@membres" not in message:
             return jsonify({"success": False, "error": 'Le message doit contenir "@membres"'}), 400
+        if timezone not in TIMEZONES:
+            return jsonify({"success": False, "error": "Fuseau horaire inconnu"}), 400
 
-        await db.update_guild_settings(guild_id, role_id, channel_id, message)
+        await db.update_guild_settings(guild_id, role_id, channel_id, message, timezone)
+        # Les rôles/salons ont pu changer côté Discord : on force un rafraîchissement
+        discord_cache.invalidate_where(lambda key: key[0] == guild_id)
         return jsonify({"success": True})
 
+    # Appels Discord et lectures DB indépendants, lancés en parallèle.
+    # Un appel en échec est remplacé par sa valeur par défaut pour afficher la page en mode dégradé.
+    fetches = {
+        'roles': (get_guild_resource(guild_id, 'roles', f'/guilds/{guild_id}/roles'), []),
+        'channels': (get_guild_resource(guild_id, 'channels', f'/guilds/{guild_id}/channels'), []),
+        'guild': (get_guild_resource(guild_id, 'guild', f'/guilds/{guild_id}'), {}),
+        'settings': (db.get_guild_settings(guild_id), None),
+    }
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(coro for coro, _ in fetches.values()), return_exceptions=True)
+    fetch_ms = (time.perf_counter() - t0) * 1000
+
+    data = {}
+    degraded = []
+    for (name, (_, default)), result in zip(fetches.items(), results):
+        if isinstance(result, Exception):
+            print(f"[server_config {guild_id}] Échec de la récupération '{name}': {result}", flush=True)
+            degraded.append(name)
+            result = default
+        data[name] = result
+    print(f"[server_config {guild_id}] Données récupérées en {fetch_ms:.1f} ms", flush=True)
+
+    roles = data['roles']
+    channels = [c for c in data['channels'] if c['type'] == 0]   # salons texte uniquement
+    guild_name = data['guild'].get('name', 'Serveur inconnu')
+    current_settings = data['settings']
+
     # Rendu template
-    return await render_template(
+    response = await make_response(await render_template(
         "server_config.html",
         guild_id=guild_id,
         guild_name=guild_name,
         roles=roles,
         channels=channels,
         settings=current_settings,
-        members=final_members,
-        birthdays=all_birthdays_str_keys
-    )
-
+        timezones=TIMEZONES,
+        default_timezone=db.DEFAULT_TIMEZONE,
+        degraded=degraded
+    ))
+    response.headers['Server-Timing'] = f'fetch;dur={fetch_ms:.1f}'
+    return response
+
+
+@app.route('/api/guild/<int:guild_id>/members')
+async def guild_members(guild_id):
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
+
+    query = request.args.get('q', '').strip().lower()
+    filter_mode = request.args.get('filter', 'all')    # all | with | without | left
+    page = max(0, request.args.get('page', 0, type=int))
+    per_page = min(MEMBERS_MAX_PER_PAGE, max(1, request.args.get('per_page', 50, type=int)))
+
+    # Chargement partagé et poursuivi en arrière-plan au-delà de MEMBERS_LOAD_TIMEOUT
+    load = asyncio.ensure_future(get_member_rows(guild_id))
+    load.add_done_callback(lambda task: task.cancelled() or task.exception())
+    degraded = False
+    try:
+        rows = await asyncio.wait_for(asyncio.shield(load), MEMBERS_LOAD_TIMEOUT)
+    except Exception as e:
+        # Membres Discord indisponibles ou trop lents : les anniversaires enregistrés restent modifiables
+        print(f"Liste des membres du serveur {guild_id} indisponible ({e!r}) : anniversaires enregistrés seuls.", flush=True)
+        degraded = True
+        try:
+            rows = birthday_only_rows(await get_guild_birthdays(guild_id))
+        except Exception as e:
+            print(f"Erreur lors de la récupération des anniversaires du serveur {guild_id}: {e}", flush=True)
+            return jsonify({"success": False, "error": "Impossible de récupérer les membres"}), 502
+
+    if query:
+        rows = [r for r in rows if query in r['id'] or (r['username'] and query in r['username'].lower())]
+    if filter_mode == 'with':
+        rows = [r for r in rows if r['birthday']]
+    elif filter_mode == 'without':
+        rows = [r for r in rows if not r['birthday']]
+    elif filter_mode == 'left':
+        rows = [r for r in rows if r['left']]
+
+    start = page * per_page
+    return jsonify({
+        "success": True,
+        "members": rows[start:start + per_page],
+        "total": len(rows),
+        "page": page,
+        "per_page": per_page,
+        "degraded": degraded,
+    })
+
+# Prochains anniversaires du serveur (dans son fuseau horaire), du plus proche au plus lointain
+@app.route('/api/guild/<int:guild_id>/calendar')
+async def guild_calendar(guild_id):
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
+
+    days = min(CALENDAR_MAX_DAYS, max(1, request.args.get('days', 30, type=int)))
+    limit = min(CALENDAR_MAX_LIMIT, max(1, request.args.get('limit', 100, type=int)))
+
+    settings = await db.get_guild_settings(guild_id)
+    tz_name = settings['timezone'] if settings else db.DEFAULT_TIMEZONE
+    today = datetime.now(ZoneInfo(tz_name)).date()
+    entries = await db.get_upcoming_birthdays(guild_id, today, days, limit)
+
+    return jsonify({
+        "success": True,
+        "today": today.isoformat(),
+        "timezone": tz_name,
+        "days": days,
+        "birthdays": [
+            {
+                "member_id": str(e['member_id']),
+                "birthday_date": e['birthday_date'].isoformat(),
+                "next_birthday": e['next_birthday'].isoformat(),
+                "days_until": e['days_until'],
+                "age": e['age'],
+            }
+            for e in entries
+        ],
+    })
+
+# Sonde de vivacité : le process répond (sans dépendre de la base ni de Discord)
+@app.route('/healthz')
+async def healthz():
+    return jsonify({"status": "ok"})
+
+# Sonde de disponibilité : le worker peut servir les pages (base de données joignable)
+@app.route('/readyz')
+async def readyz():
+    ready = await db.ping()
+    return jsonify({"database": ready}), 200 if ready else 503
+
+# Tant que la base n'est pas connectée, les pages répondent 503 au lieu d'échouer
+@app.before_request
+async def require_database():
+    if db.pool is None and request.endpoint not in DB_FREE_ENDPOINTS:
+        response = jsonify({"success": False, "error": "Base de données indisponible"})
+        return response, 503, {'Retry-After': str(DB_RETRY_MAX_DELAY)}
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        return "Métriques désactivées", 404
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@app.route('/api/cache_stats')
+async def cache_stats():
+    if 'user' not in session:
+        return jsonify({"success": False, "error": "Authentification requise"}), 401
+    return jsonify(discord_cache.stats())
+
+# Réconciliation du rôle d'anniversaire, exécutée par le bot (parcours complet des détenteurs du rôle)
+@app.route('/api/guild/<int:guild_id>/roles/reconcile', methods=['POST'])
+async def reconcile_roles(guild_id):
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
+
+    status, data = await bot_internal_request('POST', f'/guilds/{guild_id}/roles/reconcile', timeout=RECONCILE_TIMEOUT)
+    if status == 200:
+        return jsonify({"success": True, **data})
+    if status == 409:
+        return jsonify({"success": False, "error": data.get('error')}), 409
+    return jsonify({"success": False, "error": "Le bot n'a pas pu traiter la demande"}), 502
 
 @app.route('/api/update_birthday', methods=['POST'])
 async def update_birthday():
@@ -171,10 +606,14 @@ async def update_birthday():
 
     if not all([guild_id, member_id, birthday_date_str]):
         return jsonify({"success": False, "error": "Données manquantes"}), 400
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
 
     try:
         birthday_date = datetime.strptime(birthday_date_str, "%Y-%m-%d").date()
         await db.add_birthday(int(guild_id), int(member_id), birthday_date)
+        birthdays_changed(guild_id)
         return jsonify({"success": True, "message": "Anniversaire mis à jour"}), 200
     except ValueError:
         return jsonify({"success": False, "error": "Format de date invalide, attendu YYYY-MM-DD"}), 400
@@ -193,30 +632,189 @@ async def delete_birthday():
 
     if not all([guild_id, member_id]):
         return jsonify({"success": False, "error": "Données manquantes"}), 400
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
 
     try:
         await db.delete_birthday(int(guild_id), int(member_id))
+        birthdays_changed(guild_id)
         return jsonify({"success": True, "message": "Anniversaire supprimé"}), 200
     except Exception as e:
         print(f"Erreur lors de la suppression de l'anniversaire: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Modifications groupées par le dashboard : {"changes": [{"member_id", "birthday_date"}]}.
+# birthday_date vide ou null = suppression ; pour un même membre, la dernière modification l'emporte.
+# Le lot est appliqué en entier dans une transaction, ou refusé s'il contient une ligne invalide.
+@app.route('/api/guild/<int:guild_id>/birthdays/batch', methods=['POST'])
+async def batch_birthdays(guild_id):
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
+
+    data = await request.get_json(silent=True) or {}
+    changes = data.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return jsonify({"success": False, "error": "Aucune modification"}), 400
+    if len(changes) > BATCH_MAX_CHANGES:
+        return jsonify({"success": False, "error": f"Au plus {BATCH_MAX_CHANGES} modifications par lot"}), 413
+
+    latest = {}
+    errors = []
+    for line, change in enumerate(changes, start=1):
+        try:
+            member_id = int(change['member_id'])
+            birthday_date_str = change.get('birthday_date')
+            latest[member_id] = datetime.strptime(birthday_date_str, "%Y-%m-%d").date() if birthday_date_str else None
+        except (KeyError, TypeError, ValueError):
+            errors.append(f"Modification {line} invalide : {change}")
+    if errors:
+        return jsonify({"success": False, "error": "Modifications invalides", "details": errors[:20]}), 400
+
+    upserts = [(member_id, birthday_date) for member_id, birthday_date in latest.items() if birthday_date]
+    deletes = [member_id for member_id, birthday_date in latest.items() if not birthday_date]
+
+    t0 = time.perf_counter()
+    try:
+        updated, deleted = await db.apply_birthday_changes(guild_id, upserts, deletes)
+        birthdays_changed(guild_id)
+    except Exception as e:
+        print(f"Erreur lors de l'application d'un lot de {len(latest)} modifications sur le serveur {guild_id}: {e}", flush=True)
+        return jsonify({"success": False, "error": "Erreur lors de l'enregistrement"}), 500
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+
+    response = jsonify({"success": True, "updated": updated, "deleted": deleted})
+    response.headers['Server-Timing'] = f'db;dur={elapsed_ms:.1f}'
+    return response
+
 
-# --- Initialisation de la BDD ---
+# --- Import / export en masse ---
+# Convertit des lignes (member_id, date YYYY-MM-DD) en enregistrements pour le COPY
+def parse_birthday_rows(rows):
+    records = []
+    errors = []
+    for line, (member_id, birthday_date_str) in enumerate(rows, start=1):
+        try:
+            records.append((int(member_id), datetime.strptime(str(birthday_date_str).strip(), "%Y-%m-%d").date()))
+        except (TypeError, ValueError):
+            errors.append(f"Ligne {line} invalide : {member_id}, {birthday_date_str}")
+    return records, errors
+
+@app.route('/api/guild/<int:guild_id>/birthdays/import', methods=['POST'])
+async def import_birthdays(guild_id):
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
+
+    # CSV (corps brut ou fichier "file") : member_id,birthday_date — JSON : [{"member_id", "birthday_date"}]
+    # Un membre présent sur plusieurs lignes reçoit la date de sa dernière ligne
+    files = await request.files
+    if 'file' in files or request.mimetype == 'text/csv':
+        raw = files['file'].read().decode('utf-8-sig') if 'file' in files else (await request.get_data(as_text=True))
+        rows = [r for r in csv.reader(io.StringIO(raw)) if r]
+        if rows and not rows[0][0].strip().isdigit():
+            rows = rows[1:]  # en-tête
+        if any(len(r) < 2 for r in rows):
+            return jsonify({"success": False, "error": "Chaque ligne doit contenir member_id,birthday_date"}), 400
+        rows = [(r[0], r[1]) for r in rows]
+    else:
+        data = await request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify({"success": False, "error": "Format attendu : CSV ou liste JSON"}), 400
+        rows = [(d.get('member_id'), d.get('birthday_date')) for d in data if isinstance(d, dict)]
+
+    records, errors = parse_birthday_rows(rows)
+    if errors:
+        return jsonify({"success": False, "error": "Données invalides", "details": errors[:20]}), 400
+
+    try:
+        count = await db.import_birthdays(guild_id, records)
+        birthdays_changed(guild_id)
+    except Exception as e:
+        print(f"Erreur lors de l'import des anniversaires du serveur {guild_id}: {e}", flush=True)
+        return jsonify({"success": False, "error": str(e)}), 500
+    return jsonify({"success": True, "imported": count}), 200
+
+@app.route('/api/guild/<int:guild_id>/birthdays/export')
+async def export_birthdays(guild_id):
+    status = await guild_admin_status(guild_id)
+    if status != 200:
+        return guild_access_error(status)
+
+    export_format = request.args.get('format', 'csv')
+
+    async def generate_csv():
+        yield "member_id,birthday_date\n"
+        async for member_id, birthday_date in db.iter_guild_birthdays(guild_id):
+            yield f"{member_id},{birthday_date}\n"
+
+    async def generate_json():
+        yield "["
+        first = True
+        async for member_id, birthday_date in db.iter_guild_birthdays(guild_id):
+            yield ("" if first else ",") + json.dumps({"member_id": str(member_id), "birthday_date": str(birthday_date)})
+            first = False
+        yield "]"
+
+    if export_format == 'json':
+        response = Response(generate_json(), mimetype='application/json')
+    else:
+        response = Response(generate_csv(), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="birthdays_{guild_id}.{export_format if export_format == "json" else "csv"}"'
+    response.timeout = None  # export potentiellement long
+    return response
+
+
+# --- Initialisation de la BDD et du client HTTP ---
 @app.before_serving
 async def startup():
-    for i in range(10):
+    global http_session
+    http_session = create_http_session()
+
+    # Le démarrage n'attend pas la base : /healthz répond tout de suite, /readyz quand elle est prête
+    global db_connect_task, session_purge_task
+    db_connect_task = asyncio.create_task(keep_db_connected())
+    session_purge_task = asyncio.create_task(purge_sessions())
+
+# Connexion à la base, réessayée en arrière-plan jusqu'au succès (attente doublée à chaque échec).
+# Une fois le pool créé, asyncpg remplace lui-même les connexions perdues.
+async def keep_db_connected():
+    delay = DB_RETRY_MIN_DELAY
+    while db.pool is None:
         try:
             await db.connect()
-            await db.create_tables()
-            print("DB prête !")
-            return
+            print("DB prête !", flush=True)
         except Exception as e:
-            print(f"DB non prête, retry dans 3s... ({i+1}/10)")
-            await asyncio.sleep(3)
-    raise Exception("Impossible de se connecter à PostgreSQL après 10 essais")
+            print(f"DB non prête, retry dans {delay:g}s... Erreur: {e}", flush=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, DB_RETRY_MAX_DELAY)
+    await listen_birthday_changes()
+
+# Suppression périodique des sessions expirées
+async def purge_sessions():
+    while True:
+        if db.pool is not None:
+            try:
+                purged = await db.purge_web_sessions()
+                if purged:
+                    print(f"{purged} session(s) expirée(s) supprimée(s).", flush=True)
+            except Exception as e:
+                print(f"Erreur lors de la purge des sessions: {e}", flush=True)
+        await asyncio.sleep(SESSION_PURGE_INTERVAL if db.pool is not None else DB_RETRY_MAX_DELAY)
+
+@app.after_serving
+async def shutdown():
+    for task in (db_connect_task, session_purge_task):
+        if task:
+            task.cancel()
+    if http_session:
+        await http_session.close()
+    await db.close()
+    metrics.mark_process_dead()
 
 # --- Main ---
+# Serveur de développement (un seul process) ; en production : python serve.py
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
 
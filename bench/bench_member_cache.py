@@ -0,0 +1,95 @@
+# bench/bench_member_cache.py
+# Mémoire résidente du cache de discord.py pour des serveurs synthétiques, avec le cache des membres
+# par défaut et en mode LOW_MEMORY (MemberCacheFlags.none()). Chaque mode est mesuré dans un process séparé.
+#
+# Usage :
+#   python bench/bench_member_cache.py --guilds 20 --members 50000
+import argparse
+import gc
+import json
+import subprocess
+import sys
+
+import discord
+from discord.state import ConnectionState
+
+
+def rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def synthetic_guild(guild_id, members):
+    # Payload GUILD_CREATE minimal, tel que reçu de la gateway
+    return {
+        "id": str(guild_id),
+        "name": f"Serveur {guild_id}",
+        "member_count": members,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0,
+                   "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+        "channels": [],
+        "members": [
+            {
+                "user": {"id": str(guild_id * 10**6 + i), "username": f"membre{i}", "discriminator": "0",
+                         "avatar": None, "global_name": f"Membre {i}"},
+                "roles": [],
+                "joined_at": "2020-01-01T00:00:00+00:00",
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+            for i in range(members)
+        ],
+    }
+
+
+def measure(low_memory, guilds, members):
+    intents = discord.Intents.default()
+    intents.members = True
+    flags = discord.MemberCacheFlags.none() if low_memory else discord.MemberCacheFlags.from_intents(intents)
+    state = ConnectionState(
+        dispatch=lambda *args, **kwargs: None, handlers={}, hooks={}, http=None,
+        intents=intents, member_cache_flags=flags, chunk_guilds_at_startup=False,
+    )
+
+    gc.collect()
+    before = rss_mib()
+    cached = []
+    for guild_id in range(1, guilds + 1):
+        # Le payload est construit puis libéré serveur par serveur, comme à la réception des événements
+        cached.append(discord.Guild(data=synthetic_guild(guild_id, members), state=state))
+        gc.collect()
+    after = rss_mib()
+    return {
+        "mode": "LOW_MEMORY" if low_memory else "cache complet",
+        "members_cached": sum(len(g.members) for g in cached),
+        "rss_mib": after - before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=50_000)
+    parser.add_argument("--mode", choices=["full", "low"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.mode == "low", args.guilds, args.members)))
+        return
+
+    print(f"{args.guilds} serveurs × {args.members} membres", flush=True)
+    for mode in ("full", "low"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--guilds", str(args.guilds), "--members", str(args.members), "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(out)
+        print(f"{result['mode']:<14} {result['members_cached']:>10} membres en cache | RSS +{result['rss_mib']:8.1f} MiB", flush=True)
+
+
+if __name__ == "__main__":
+    main()
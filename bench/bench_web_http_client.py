@@ -0,0 +1,96 @@
+# bench/bench_web_http_client.py
+# Compare le débit du dashboard avec l'ancien client bloquant (requests) et le client aiohttp partagé,
+# contre un faux serveur de l'API Discord qui répond avec une latence fixe.
+#
+# Usage :
+#   python bench/bench_web_http_client.py --requests 200 --concurrency 50 --latency 0.05
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import requests
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+STUB_PORT = 8765
+os.environ.setdefault("DISCORD_API_ENDPOINT", f"http://127.0.0.1:{STUB_PORT}")
+import app as web_app
+
+
+def start_stub(latency):
+    # Faux serveur Discord dans son propre thread / event loop
+    async def guilds(request):
+        await asyncio.sleep(latency)
+        return web.json_response([{"id": str(i), "name": f"Serveur {i}"} for i in range(20)])
+
+    stub = web.Application()
+    stub.router.add_get("/users/@me/guilds", guilds)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(stub)
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", STUB_PORT).start())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    time.sleep(0.5)
+
+
+async def blocking_get_bot_guilds():
+    # Ancienne implémentation : requests.get dans un handler async
+    headers = {"Authorization": f"Bot {web_app.DISCORD_TOKEN}"}
+    resp = requests.get(f"{web_app.API_ENDPOINT}/users/@me/guilds", headers=headers)
+    if resp.status_code == 200:
+        return [int(g["id"]) for g in resp.json()]
+    return []
+
+
+async def aiohttp_get_bot_guilds():
+    # Client partagé, sans le cache de app.get_bot_guilds : chaque appel touche le faux serveur
+    headers = {"Authorization": f"Bot {web_app.DISCORD_TOKEN}"}
+    status, data = await web_app.discord_request("GET", "/users/@me/guilds", headers)
+    if status == 200:
+        return [int(g["id"]) for g in data]
+    return []
+
+
+async def load(label, func, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await func()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<10} {total} requêtes en {elapsed:6.2f}s → {total / elapsed:8.1f} req/s", flush=True)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    start_stub(args.latency)
+
+    await load("bloquant", blocking_get_bot_guilds, args.requests, args.concurrency)
+
+    web_app.http_session = web_app.create_http_session()
+    try:
+        await load("aiohttp", aiohttp_get_bot_guilds, args.requests, args.concurrency)
+    finally:
+        await web_app.http_session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,39 +1,118 @@
 import os
-from BirthdayPaginator import BirthdayPaginator
+from BirthdayPaginator import render_page, escape_markdown, BirthdayPageButton, BirthdayCloseButton, start_listening as listen_birthday_changes
 import discord
 from discord import Embed
 from discord.ext import commands, tasks
 import asyncio
 import database as db
-from datetime import date, timedelta, datetime, time
-from zoneinfo import ZoneInfo
+import metrics
+import settings_cache
+import internal_api
+import cleanup
+from members import LOW_MEMORY, resolve_members
+from roles import reconcile_role
+from dispatcher import GuildDispatcher
+from functools import partial
+from datetime import date, timedelta, datetime, time, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Commandes préfixées (!set-anniv...) : PREFIX_COMMANDS=0 pour ne garder que les commandes slash.
+# Le bot n'a alors plus besoin de recevoir les messages du serveur (intents message_content / messages).
+PREFIX_COMMANDS = os.getenv('PREFIX_COMMANDS', '1') == '1'
 
 # Créez une instance de l'intention (Intents) pour le bot
 intents = discord.Intents.default()
 intents.members = True 
-intents.message_content = True
+intents.message_content = PREFIX_COMMANDS
+intents.guild_messages = PREFIX_COMMANDS
+intents.dm_messages = PREFIX_COMMANDS
 intents.guilds = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Sharding : SHARD_COUNT = nombre total de shards (0 = pas de sharding),
+# SHARD_IDS = shards gérés par ce process ("0-3,8" ; tous si vide). Voir launcher.py.
+def parse_shard_ids(value):
+    shard_ids = []
+    for part in filter(None, value.replace(' ', '').split(',')):
+        start, _, end = part.partition('-')
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids or None
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS', '')) if SHARD_COUNT else None
+
+# Mode basse mémoire (LOW_MEMORY=1) : aucun membre en cache ni chargement des membres au démarrage,
+# les membres nécessaires sont demandés à la demande (voir members.py)
+bot_options = {}
+if LOW_MEMORY:
+    bot_options['member_cache_flags'] = discord.MemberCacheFlags.none()
+    bot_options['chunk_guilds_at_startup'] = False
+
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix='!',
+        intents=intents,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+        **bot_options,
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, **bot_options)
+
+# Shards dont ce process traite les anniversaires : filtre SQL (None = tous les serveurs)
+# et identifiants utilisés pour les curseurs de planification
+DAILY_SHARDS = (SHARD_IDS, SHARD_COUNT) if SHARD_IDS else None
+SCHEDULE_SHARD_IDS = SHARD_IDS or list(range(SHARD_COUNT)) or [0]
+
+# API interne servant rôles, salons et membres au dashboard (voir internal_api.py) :
+# activée si BOT_INTERNAL_PORT et INTERNAL_API_TOKEN sont définis
+BOT_INTERNAL_PORT = int(os.getenv('BOT_INTERNAL_PORT', '0'))
+INTERNAL_API_TOKEN = os.getenv('INTERNAL_API_TOKEN', '')
+
+settings_listener_task = None
+birthdays_listener_task = None
+
+# Appelée une seule fois avant la connexion : les boutons persistants du paginateur
+# sont reconnus à partir de leur custom_id, y compris sur les messages envoyés avant un redémarrage
+@bot.event
+async def setup_hook():
+    # La base doit être prête avant la connexion à la gateway (commandes reçues dès la connexion)
+    await db.connect_with_retry()
+
+    # Paramètres des serveurs gardés en mémoire, invalidés par les notifications du dashboard
+    global settings_listener_task, birthdays_listener_task
+    settings_listener_task = asyncio.create_task(settings_cache.start())
+    # Pages du paginateur invalidées à chaque modification des anniversaires d'un serveur
+    birthdays_listener_task = asyncio.create_task(listen_birthday_changes())
+
+    bot.add_dynamic_items(BirthdayPageButton, BirthdayCloseButton)
+
+    if os.getenv('SYNC_COMMANDS', '1') == '1':
+        synced = await bot.tree.sync()
+        print(f"{len(synced)} commandes slash synchronisées.", flush=True)
+
+    if BOT_INTERNAL_PORT and INTERNAL_API_TOKEN:
+        # Avec SHARD_IDS, ce process ne connaît qu'une partie des serveurs du bot
+        try:
+            await internal_api.start(
+                bot, BOT_INTERNAL_PORT, INTERNAL_API_TOKEN,
+                complete_guild_list=not SHARD_IDS, reconcile=reconcile_guild_now,
+            )
+        except OSError as e:
+            # Port déjà pris : le bot fonctionne sans, le dashboard se replie sur l'API REST
+            print(f"API interne du bot non démarrée sur le port {BOT_INTERNAL_PORT}: {e}", flush=True)
+    elif BOT_INTERNAL_PORT:
+        print("BOT_INTERNAL_PORT défini sans INTERNAL_API_TOKEN : API interne désactivée.", flush=True)
 
 # La fonction `on_ready` est appelée lorsque le bot est connecté à Discord
 @bot.event
 async def on_ready():
     print(f'Bot connecté en tant que {bot.user}!', flush=True)
 
-    # Boucle d'attente de la DB
-    for i in range(10):
-        try:
-            await db.connect()
-            await db.create_tables()
-            print("Connecté à PostgreSQL.", flush=True)
-            break
-        except Exception as e:
-            print(f"DB non prête, retry dans 3s... ({i+1}/10) Erreur: {e}", flush=True)
-            await asyncio.sleep(3)
-    else:
-        print("Impossible de se connecter à PostgreSQL après 10 essais.", flush=True)
-        return
+    # Reprise du travail inachevé et rattrapage des dates manquées pendant l'arrêt
+    try:
+        await run_pending_birthdays()
+    except Exception as e:
+        print(f"Erreur lors du rattrapage des anniversaires: {e}", flush=True)
 
     print(f"daily_birthday_check.is_running() = {daily_birthday_check.is_running()}", flush=True)
 
@@ -45,181 +124,447 @@ async def on_ready():
 
     print("La vérification quotidienne des anniversaires est démarrée.", flush=True)
 
-# --- Tâches Périodiques du Bot ---
-# Exécution tous les jours à 00:00 heure de Paris
-@tasks.loop(time=time(hour=0, minute=0, tzinfo=ZoneInfo("Europe/Paris")))
-async def daily_birthday_check():
-    paris_time = datetime.now(ZoneInfo("Europe/Paris"))
-    today = paris_time.date()
-    print(f"[{paris_time}] Vérification des anniversaires pour la date : {today}", flush=True)
+    if not compaction.is_running():
+        compaction.start()
 
-    # Section 1: Célébration des anniversaires d'aujourd'hui
-    birthdays_to_celebrate = await db.get_birthdays_on_date(today)
-    print(f"Anniversaires trouvés aujourd'hui: {birthdays_to_celebrate}", flush=True)
+# --- Actions par serveur ---
+# Célébration des anniversaires du jour sur un serveur
+# (run : étapes déjà faites pour cette date, voir db.get_birthday_runs)
+async def celebrate_guild(guild_id, member_ids, settings, run_date, run):
+    if not settings or 'channel_id' not in settings or not settings['channel_id']:
+        print(f"Les paramètres pour le serveur {guild_id} sont incomplets. Impossible de célébrer.", flush=True)
+        return
 
-    if not birthdays_to_celebrate:
-        print("Aucun anniversaire à célébrer aujourd'hui.", flush=True)
-    else:
-        guild_birthdays = {}
-        for birthday_info in birthdays_to_celebrate:
-            guild_id = birthday_info['guild_id']
-            member_id = birthday_info['member_id']
+    guild = bot.get_guild(guild_id)
+    if not guild:
+        return
 
-            if guild_id not in guild_birthdays:
-                guild_birthdays[guild_id] = []
-            guild_birthdays[guild_id].append(member_id)
+    try:
+        channel = guild.get_channel(settings['channel_id'])
+        if not channel:
+            return
 
-        # Envoi d'un message pour chaque serveur
-        for guild_id, member_ids in guild_birthdays.items():
-            settings = await db.get_guild_settings(guild_id)
+        # Création de la liste de mentions
+        members = await resolve_members(guild, member_ids)
+        mentions = [members[member_id].mention for member_id in member_ids if member_id in members]
 
-            if not settings or 'channel_id' not in settings or not settings['channel_id']:
-                print(f"Les paramètres pour le serveur {guild_id} sont incomplets. Impossible de célébrer.", flush=True)
-                continue
+        if not mentions:
+            return
 
-            try:
-                guild = bot.get_guild(guild_id)
-                if not guild:
-                    continue
+        # Le message n'est envoyé qu'une fois par date, même en cas de reprise après un crash ;
+        # un envoi échoué est retenté aux réveils suivants (voir retry_announcements)
+        if not run.get('announced') and await db.claim_announcement(guild_id, run_date, ANNOUNCE_RETRY_DELAY):
+            message = settings.get('birthday_message', "Joyeux anniversaire @membres !")
+            message = message.replace('@membres', ', '.join(mentions))
 
-                channel = guild.get_channel(settings['channel_id'])
-                if not channel:
-                    continue
+            with metrics.discord_call('bot', 'send_message'):
+                await channel.send(message)
+            await db.mark_birthday_run(guild_id, run_date, 'announced')
+            print(f"Message d'anniversaire envoyé sur le serveur {guild.name} pour les membres: {', '.join(mentions)}.", flush=True)
+        else:
+            print(f"Anniversaires du {run_date} déjà annoncés (ou envoi en cours) sur le serveur {guild.name}.", flush=True)
+
+    except discord.errors.Forbidden:
+        print(f"Erreur de permission sur le serveur {guild.name}. Vérifiez les permissions du bot.", flush=True)
+    except Exception as e:
+        print(f"Une erreur s'est produite lors du traitement des anniversaires sur le serveur {guild_id}: {e}", flush=True)
+
+# Réconciliation du rôle d'anniversaire d'un serveur avec les anniversaires du jour
+# (candidate_ids : membres fêtés les jours précédents, anciens détenteurs possibles du rôle)
+async def reconcile_guild_roles(guild_id, member_ids, candidate_ids, settings, run_date, run):
+    if not settings or not settings.get('role_id'):
+        return
+    # En mode LOW_MEMORY, chaque réconciliation interroge la gateway : une seule réussite par date suffit
+    if LOW_MEMORY and run.get('roles_added') and run.get('roles_removed'):
+        return
 
-                # Création de la liste de mentions
-                mentions = []
-                for member_id in member_ids:
-                    member = guild.get_member(member_id)
-                    if member:
-                        mentions.append(member.mention)
+    guild = bot.get_guild(guild_id)
+    if not guild:
+        return
 
-                if not mentions:
-                    continue
+    role = guild.get_role(int(settings['role_id']))
+    if not role:
+        print(f"Rôle avec l'ID {settings['role_id']} introuvable sur le serveur {guild.name}.", flush=True)
+        return
 
-                message = settings.get('birthday_message', "Joyeux anniversaire @membres !")
-                message = message.replace('@membres', ', '.join(mentions))
+    result = await reconcile_role(guild, role, member_ids, candidate_ids)
+    if not result['failed'] and (member_ids or candidate_ids):
+        await db.mark_birthday_run(guild_id, run_date, 'roles_added', 'roles_removed')
+    return result
+
+# Réconciliation à la demande (dashboard) : parcours complet des détenteurs du rôle, y compris en LOW_MEMORY.
+# Retourne None si le serveur n'est pas géré par ce process, {"error": ...} si aucun rôle n'est utilisable.
+async def reconcile_guild_now(guild_id):
+    guild = bot.get_guild(guild_id)
+    if not guild:
+        return None
+
+    settings = await settings_cache.get(guild_id)
+    if not settings or not settings.get('role_id'):
+        return {"error": "Aucun rôle d'anniversaire configuré"}
+    role = guild.get_role(int(settings['role_id']))
+    if not role:
+        return {"error": "Rôle d'anniversaire introuvable"}
+
+    today = datetime.now(ZoneInfo(settings['timezone'])).date()
+    member_ids = await db.get_guild_birthdays_on_date(guild_id, today)
+    return await reconcile_role(guild, role, member_ids, full_scan=True)
+
+# Regroupe une liste d'anniversaires par serveur : {guild_id: [member_id, ...]}
+def group_by_guild(birthdays):
+    guild_birthdays = {}
+    for birthday_info in birthdays:
+        guild_birthdays.setdefault(birthday_info['guild_id'], []).append(birthday_info['member_id'])
+    return guild_birthdays
 
-                await channel.send(message)
-                print(f"Message d'anniversaire envoyé sur le serveur {guild.name} pour les membres: {', '.join(mentions)}.", flush=True)
-
-                # Ajoutez le rôle d'anniversaire si configuré
-                role_id = settings.get('role_id')
-                if role_id:
-                    role = guild.get_role(int(role_id))
-                    if role:
-                        for member_id in member_ids:
-                            member = guild.get_member(member_id)
-                            if member and role not in member.roles:
-                                await member.add_roles(role)
-                                print(f"Rôle '{role.name}' ajouté à {member.display_name}.", flush=True)
-                    else:
-                        print(f"Rôle avec l'ID {role_id} introuvable sur le serveur {guild.name}.")
-            except discord.errors.Forbidden:
-                print(f"Erreur de permission sur le serveur {guild.name}. Vérifiez les permissions du bot.", flush=True)
-            except Exception as e:
-                print(f"Une erreur s'est produite lors du traitement des anniversaires sur le serveur {guild_id}: {e}", flush=True)
-
-    # Section 2: Retrait des rôles d'anniversaire
-    yesterday = today - timedelta(days=1)
-    print(f"Vérification des anniversaires pour la date d'hier : {yesterday}", flush=True)
-
-    birthdays_yesterday = await db.get_birthdays_on_date(yesterday)
-
-    if not birthdays_yesterday:
-        print("Aucun rôle à retirer aujourd'hui.", flush=True)
-    else:
-        for birthday_info in birthdays_yesterday:
-            guild_id = birthday_info['guild_id']
-            member_id = birthday_info['member_id']
-
-            settings = await db.get_guild_settings(guild_id)
-
-            if not settings or 'role_id' not in settings or not settings['role_id']:
-                print(f"Pas de rôle d'anniversaire configuré pour le serveur {guild_id}.", flush=True)
-                continue
-
-            try:
-                guild = bot.get_guild(guild_id)
-                if not guild:
-                    continue
-
-                member = guild.get_member(member_id)
-                if not member:
-                    continue
-
-                role_id = settings['role_id']
-                role = guild.get_role(int(role_id))
-
-                if role and role in member.roles:
-                    await member.remove_roles(role)
-                    print(f"Rôle '{role.name}' retiré de {member.display_name} sur le serveur {guild.name}.", flush=True)
-
-            except discord.errors.Forbidden:
-                print(f"Erreur de permission. Le bot ne peut pas retirer le rôle sur le serveur {guild.name}.", flush=True)
-            except Exception as e:
-                print(f"Une erreur s'est produite lors du retrait du rôle de {member_id}: {e}", flush=True)
-    
-    # --- Log de la prochaine exécution ---
-    now = datetime.now(ZoneInfo("Europe/Paris"))
-    tomorrow = now.date() + timedelta(days=1)
-    next_run = datetime.combine(tomorrow, time(0,0, tzinfo=ZoneInfo("Europe/Paris")))
-    print(f"[{now}] Task terminée → prochaine exécution prévue à {next_run}", flush=True)
+# --- Tâches Périodiques du Bot ---
+# Traitement du jour local run_date pour les serveurs des fuseaux horaires donnés : annonce des anniversaires
+# du jour puis réconciliation du rôle d'anniversaire.
+# stale : {guild_id: [member_id]} fêtés lors de dates manquées, anciens détenteurs possibles du rôle
+async def process_birthdays(run_date, timezones, stale=None):
+    yesterday = run_date - timedelta(days=1)
+    print(f"Vérification des anniversaires pour la date : {run_date} (fuseaux : {', '.join(timezones)})", flush=True)
+
+    birthdays_to_celebrate = await db.get_birthdays_on_date(run_date, timezones, DAILY_SHARDS)
+    birthdays_yesterday = await db.get_birthdays_on_date(yesterday, timezones, DAILY_SHARDS)
+    print(f"Anniversaires trouvés aujourd'hui: {birthdays_to_celebrate}", flush=True)
+
+    if not birthdays_to_celebrate:
+        print("Aucun anniversaire à célébrer aujourd'hui.", flush=True)
+
+    guild_birthdays = group_by_guild(birthdays_to_celebrate)
+    candidates = group_by_guild(birthdays_yesterday)
+    for guild_id, member_ids in (stale or {}).items():
+        candidates.setdefault(guild_id, []).extend(member_ids)
+
+    # Avec le cache des membres, comparer aux détenteurs du rôle ne coûte aucun appel :
+    # tous les serveurs ayant un rôle configuré sont réconciliés, même sans anniversaire récent
+    role_guilds = [] if LOW_MEMORY else await db.get_role_guilds(timezones, DAILY_SHARDS)
+
+    # Paramètres et avancement de tous les serveurs concernés, une requête chacun
+    guild_ids = guild_birthdays.keys() | candidates.keys() | set(role_guilds)
+    all_settings = await settings_cache.get_many(guild_ids) if guild_ids else {}
+    runs = await db.get_birthday_runs(guild_ids, run_date) if guild_ids else {}
+
+    # Les serveurs sont traités en parallèle, les actions d'un serveur restent dans l'ordre :
+    # annonce du jour puis réconciliation du rôle
+    dispatcher = GuildDispatcher()
+    for guild_id, member_ids in guild_birthdays.items():
+        dispatcher.submit(guild_id, partial(celebrate_guild, guild_id, member_ids, all_settings.get(guild_id), run_date, runs.get(guild_id, {})))
+    for guild_id in guild_ids:
+        dispatcher.submit(guild_id, partial(
+            reconcile_guild_roles, guild_id, guild_birthdays.get(guild_id, []), candidates.get(guild_id, []),
+            all_settings.get(guild_id), run_date, runs.get(guild_id, {})
+        ))
+
+    stats = await dispatcher.run()
+    print(
+        f"Run terminé : {stats['guilds']} serveurs en {stats['total']:.2f}s "
+        f"(p50 {stats['p50']:.2f}s, p99 {stats['p99']:.2f}s par serveur, {stats['rate_limited']} réponses 429)",
+        flush=True
+    )
+    metrics.rate_limited('bot', stats['rate_limited'])
+    metrics.birthday_run(stats['total'], stats['guilds'], {
+        'celebrated': len(birthdays_to_celebrate),
+        'role_removal': len(birthdays_yesterday),
+    })
+
+# Dates locales restant à traiter : {(date, est_aujourd_hui): [fuseaux]}
+def pending_runs(now, timezones, cursors):
+    pending = {}
+    for tz_name in timezones:
+        try:
+            local_today = now.astimezone(ZoneInfo(tz_name)).date()
+        except (ZoneInfoNotFoundError, ValueError):
+            print(f"Fuseau horaire inconnu ignoré : {tz_name}", flush=True)
+            continue
+
+        # Fuseau jamais traité (nouveau serveur, fuseau modifié) : le jour courant est traité tout de suite
+        # (birthday_runs évite de refaire ce qui a déjà été fait pour ce serveur et cette date)
+        last_run_date = cursors.get(tz_name, local_today - timedelta(days=1))
+        # Rattrapage limité aux CATCH_UP_DAYS derniers jours
+        run_date = max(last_run_date + timedelta(days=1), local_today - timedelta(days=CATCH_UP_DAYS))
+        while run_date <= local_today:
+            pending.setdefault((run_date, run_date == local_today), []).append(tz_name)
+            run_date += timedelta(days=1)
+    return pending
+
+# Traite toutes les dates en attente (minuit passé, ou dates manquées pendant une interruption).
+# Seul le jour courant est célébré ; les membres fêtés la veille des dates manquées sont gardés
+# comme anciens détenteurs possibles du rôle pour la réconciliation du jour courant.
+async def run_pending_birthdays():
+    async with scheduler_lock:
+        now = datetime.now(timezone.utc) + SCHEDULER_TOLERANCE
+        all_timezones = await db.get_guild_timezones()
+        pending = pending_runs(now, all_timezones, await db.get_schedule_cursors(SCHEDULE_SHARD_IDS))
+
+        stale = {}
+        for (run_date, is_today), timezones in sorted(pending.items()):
+            if is_today:
+                await process_birthdays(run_date, timezones, stale)
+            else:
+                missed = await db.get_birthdays_on_date(run_date - timedelta(days=1), timezones, DAILY_SHARDS)
+                for guild_id, member_ids in group_by_guild(missed).items():
+                    stale.setdefault(guild_id, []).extend(member_ids)
+            await db.set_schedule_cursor(timezones, run_date, SCHEDULE_SHARD_IDS)
+
+        await retry_announcements(timezones_by_date(now, all_timezones))
+
+# Fuseaux regroupés par date locale : {date: [fuseaux]}
+def timezones_by_date(now, timezones):
+    by_date = {}
+    for tz_name in timezones:
+        try:
+            by_date.setdefault(now.astimezone(ZoneInfo(tz_name)).date(), []).append(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            continue
+    return by_date
+
+# Nouvel essai des annonces du jour échouées (salon indisponible, erreur Discord, arrêt pendant l'envoi),
+# au plus ANNOUNCE_MAX_ATTEMPTS essais espacés d'au moins ANNOUNCE_RETRY_DELAY secondes
+async def retry_announcements(by_date):
+    dispatcher = GuildDispatcher()
+    for run_date, timezones in by_date.items():
+        guild_ids = await db.get_announcement_retries(
+            run_date, timezones, ANNOUNCE_RETRY_DELAY, ANNOUNCE_MAX_ATTEMPTS, DAILY_SHARDS
+        )
+        if not guild_ids:
+            continue
+        all_settings = await settings_cache.get_many(guild_ids)
+        for guild_id in guild_ids:
+            member_ids = await db.get_guild_birthdays_on_date(guild_id, run_date)
+            dispatcher.submit(guild_id, partial(celebrate_guild, guild_id, member_ids, all_settings.get(guild_id), run_date, {}))
+    if dispatcher.jobs:
+        print(f"Nouvel essai des annonces d'anniversaire sur {len(dispatcher.jobs)} serveur(s).", flush=True)
+        await dispatcher.run()
+
+# Réveil tous les quarts d'heure (UTC) : tous les décalages horaires existants sont des multiples de 15 minutes.
+# Chaque réveil ne traite que les serveurs dont le fuseau a passé minuit depuis la dernière date traitée.
+SCHEDULER_STEP_MINUTES = 15
+SCHEDULER_TOLERANCE = timedelta(seconds=30)  # un timer qui se réveille un peu en avance compte quand même
+WAKEUP_TIMES = [time(hour=h, minute=m, tzinfo=timezone.utc) for h in range(24) for m in range(0, 60, SCHEDULER_STEP_MINUTES)]
+CATCH_UP_DAYS = int(os.getenv("BIRTHDAY_CATCH_UP_DAYS", "7"))
+# Annonces échouées : délai minimal entre deux essais (secondes) et nombre maximal d'essais par date
+ANNOUNCE_RETRY_DELAY = int(os.getenv("ANNOUNCE_RETRY_DELAY", "600"))
+ANNOUNCE_MAX_ATTEMPTS = int(os.getenv("ANNOUNCE_MAX_ATTEMPTS", "5"))
+scheduler_lock = asyncio.Lock()
+
+@tasks.loop(time=WAKEUP_TIMES)
+async def daily_birthday_check():
+    await run_pending_birthdays()
 
 # --- Log de planification ---
 @daily_birthday_check.before_loop
 async def before_daily_birthday_check():
     await bot.wait_until_ready()  # ✅ attendre que le bot soit prêt
-    now = datetime.now(ZoneInfo("Europe/Paris"))
-    tomorrow = now.date() + timedelta(days=1)
-    next_run = datetime.combine(tomorrow, time(0,0, tzinfo=ZoneInfo("Europe/Paris")))
-    print(f"[{now}] Task prête → prochaine exécution prévue à {next_run}", flush=True)
+    now = datetime.now(timezone.utc)
+    print(f"[{now}] Task prête → réveil toutes les {SCHEDULER_STEP_MINUTES} minutes, anniversaires fêtés à minuit dans le fuseau de chaque serveur", flush=True)
 
-# Commande pour qu'un utilisateur puisse enregistrer son anniversaire
-@bot.command(name='set-anniv')
-async def set_anniv(ctx, date_anniv: str):
+# --- Départs des membres et des serveurs (voir cleanup.py) ---
+membership_changes = cleanup.MembershipChanges()
+
+# Reçu même si le membre n'est pas en cache (mode LOW_MEMORY), contrairement à on_member_remove
+@bot.event
+async def on_raw_member_remove(payload):
+    membership_changes.member_left(payload.guild_id, payload.user.id)
+
+@bot.event
+async def on_member_join(member):
+    if not member.bot:
+        membership_changes.member_returned(member.guild.id, member.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    membership_changes.forget_guild(guild.id)
+    try:
+        await db.mark_guild_left(guild.id)
+        print(f"Serveur {guild.id} quitté : données conservées {cleanup.GUILD_RETENTION_DAYS} jours.", flush=True)
+    except Exception as e:
+        # Rattrapé par la prochaine passe de compaction
+        print(f"Erreur lors de l'enregistrement du départ du serveur {guild.id}: {e}", flush=True)
+
+@bot.event
+async def on_guild_join(guild):
+    try:
+        if await db.mark_guild_returned(guild.id):
+            print(f"Bot réinvité sur le serveur {guild.id} : anniversaires réactivés.", flush=True)
+    except Exception as e:
+        # Rattrapé par la prochaine passe de compaction
+        print(f"Erreur lors de la réactivation du serveur {guild.id}: {e}", flush=True)
+
+# Une passe par jour, la première dès la connexion : départs et retours manqués pendant un arrêt
+# (lots non envoyés au moment de l'arrêt, serveurs qui ont réinvité le bot : on_guild_join n'est pas
+# reçu pour les serveurs présents dès la connexion), puis purge des données dont la rétention est écoulée.
+# La purge porte sur toute la base : un seul process s'en charge (celui du shard 0).
+@tasks.loop(hours=24)
+async def compaction():
+    try:
+        await cleanup.find_departures(bot, membership_changes, DAILY_SHARDS, members_cached=not LOW_MEMORY)
+        if not SHARD_IDS or 0 in SHARD_IDS:
+            await cleanup.purge()
+    except Exception as e:
+        print(f"Erreur lors de la compaction: {e}", flush=True)
+
+@compaction.before_loop
+async def before_compaction():
+    await bot.wait_until_ready()
+
+# --- Commandes ---
+DATE_FORMAT_ERROR = "Le format de la date est incorrect. Utilise le format JJ/MM/YYYY."
+
+# Enregistre l'anniversaire d'un membre à partir d'une date JJ/MM/YYYY et retourne le message de réponse
+async def save_birthday(guild_id, user_id, date_anniv):
     try:
-        # Parser la date entrée au format JJ/MM/YYYY
         birthday_date = datetime.strptime(date_anniv, "%d/%m/%Y").date()
-        
-        guild_id = ctx.guild.id
-        user_id = ctx.author.id
-        await db.add_birthday(guild_id, user_id, birthday_date)
-        
-        formatted_date = birthday_date.strftime("%d/%m/%Y")
-        await ctx.send(f"Ton anniversaire a été enregistré pour le {formatted_date} !")
     except ValueError:
-        await ctx.send("Le format de la date est incorrect. Utilise le format JJ/MM/YYYY.")
+        return DATE_FORMAT_ERROR
+
+    await db.add_birthday(guild_id, user_id, birthday_date)
+
+    formatted_date = birthday_date.strftime("%d/%m/%Y")
+    return f"Ton anniversaire a été enregistré pour le {formatted_date} !"
+
+# Première page de la liste des anniversaires : (message, embed, view)
+async def birthday_list(guild):
+    total = await db.count_guild_birthdays(guild.id)
+    if not total:
+        return "Aucun anniversaire enregistré pour ce serveur.", None, None
+
+    embed, view = await render_page(guild, guild.id, await guild_today(guild.id), 0)
+    return None, embed, view
+
+# Date du jour dans le fuseau horaire du serveur
+async def guild_today(guild_id):
+    settings = await settings_cache.get(guild_id)
+    tz_name = settings['timezone'] if settings else db.DEFAULT_TIMEZONE
+    return datetime.now(ZoneInfo(tz_name)).date()
+
+UPCOMING_DEFAULT_DAYS = 7
+UPCOMING_MAX_DAYS = 31
+UPCOMING_LIMIT = 25  # nombre maximal de champs d'un embed
+
+# Anniversaires des prochains jours, regroupés par date : (message, embed)
+async def upcoming_birthdays(guild, days):
+    days = max(1, min(days, UPCOMING_MAX_DAYS))
+    entries = await db.get_upcoming_birthdays(guild.id, await guild_today(guild.id), days, UPCOMING_LIMIT)
+    if not entries:
+        return f"Aucun anniversaire dans les {days} prochains jours.", None
+
+    members = await resolve_members(guild, [entry['member_id'] for entry in entries])
+    by_date = {}
+    for entry in entries:
+        member = members.get(entry['member_id'])
+        name = escape_markdown(member.display_name) if member else f"({entry['member_id']})"
+        by_date.setdefault((entry['next_birthday'], entry['days_until']), []).append(f"{name} ({entry['age']} ans)")
+
+    embed = Embed(
+        title="📅 Prochains anniversaires",
+        description=f"Sur les {days} prochains jours",
+        color=0xFFC0CB
+    )
+    for (next_birthday, days_until), names in by_date.items():
+        when = "aujourd'hui" if days_until == 0 else "demain" if days_until == 1 else f"dans {days_until} jours"
+        embed.add_field(name=f"{next_birthday:%d/%m} — {when}", value="\n".join(names), inline=False)
+    if len(entries) == UPCOMING_LIMIT:
+        embed.set_footer(text=f"Seuls les {UPCOMING_LIMIT} premiers anniversaires sont affichés.")
+    return None, embed
+
+def help_embed():
+    embed = Embed(
+        title="📖 Commandes disponibles",
+        description="Voici les commandes que tu peux utiliser :",
+        color=0x00FF00
+    )
+
+    embed.add_field(name="/set-anniv <JJ/MM/YYYY>", value="Enregistre ton anniversaire.", inline=False)
+    embed.add_field(name="/list-anniv", value="Affiche les anniversaires enregistrés sur ce serveur.", inline=False)
+    embed.add_field(name="/upcoming [jours]", value=f"Affiche les anniversaires des prochains jours ({UPCOMING_DEFAULT_DAYS} par défaut).", inline=False)
+    embed.add_field(name="/help", value="Affiche cette aide.", inline=False)
+    if PREFIX_COMMANDS:
+        embed.set_footer(text="Les commandes sont aussi disponibles avec le préfixe ! (ex : !set-anniv)")
+    return embed
+
+# Commande pour qu'un utilisateur puisse enregistrer son anniversaire
+@bot.command(name='set-anniv')
+async def set_anniv(ctx, date_anniv: str):
+    await ctx.send(await save_birthday(ctx.guild.id, ctx.author.id, date_anniv))
 
 @bot.command(name="list-anniv")
 async def list_anniv(ctx):
-    guild_id = ctx.guild.id
-    birthdays = await db.get_all_guild_birthdays(guild_id)
-
-    if not birthdays:
-        await ctx.send("Aucun anniversaire enregistré pour ce serveur.")
-        return
+    content, embed, view = await birthday_list(ctx.guild)
+    if embed:
+        await ctx.send(embed=embed, view=view)
+    else:
+        await ctx.send(content)
 
-    view = BirthdayPaginator(ctx, birthdays)
-    await ctx.send(embed=view.get_embed(), view=view)
+@bot.command(name="upcoming")
+async def upcoming(ctx, days: int = UPCOMING_DEFAULT_DAYS):
+    content, embed = await upcoming_birthdays(ctx.guild, days)
+    await ctx.send(content, embed=embed)
 
 
 bot.remove_command("help")
 @bot.command(name="help")
 async def help_command(ctx):
-    embed = Embed(
-        title="📖 Commandes disponibles",
-        description="Voici les commandes que tu peux utiliser :",
-        color=0x00FF00
-    )
+    await ctx.send(embed=help_embed())
+
+# --- Commandes slash ---
+@bot.tree.command(name="set-anniv", description="Enregistre ton anniversaire (JJ/MM/YYYY)")
+@discord.app_commands.guild_only()
+@discord.app_commands.describe(date_anniv="Ta date de naissance au format JJ/MM/YYYY")
+@discord.app_commands.rename(date_anniv="date")
+async def slash_set_anniv(interaction: discord.Interaction, date_anniv: str):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    await interaction.followup.send(await save_birthday(interaction.guild_id, interaction.user.id, date_anniv), ephemeral=True)
+
+@slash_set_anniv.autocomplete("date_anniv")
+async def set_anniv_autocomplete(interaction: discord.Interaction, current: str):
+    choices = []
+
+    # Saisie normalisée (15-03-1990, 15.03.1990, 15031990 → 15/03/1990)
+    digits = ''.join(c for c in current if c.isdigit())
+    if len(digits) == 8:
+        try:
+            normalized = datetime.strptime(digits, "%d%m%Y").strftime("%d/%m/%Y")
+            choices.append(discord.app_commands.Choice(name=normalized, value=normalized))
+        except ValueError:
+            pass
+
+    # Date déjà enregistrée
+    current_birthday = await db.get_birthday(interaction.guild_id, interaction.user.id)
+    if current_birthday:
+        saved = current_birthday.strftime("%d/%m/%Y")
+        if not choices or choices[0].value != saved:
+            choices.append(discord.app_commands.Choice(name=f"{saved} (date actuelle)", value=saved))
+    return choices
+
+@bot.tree.command(name="list-anniv", description="Affiche les anniversaires enregistrés sur ce serveur")
+@discord.app_commands.guild_only()
+async def slash_list_anniv(interaction: discord.Interaction):
+    await interaction.response.defer(thinking=True)
+    content, embed, view = await birthday_list(interaction.guild)
+    if embed:
+        await interaction.followup.send(embed=embed, view=view)
+    else:
+        await interaction.followup.send(content)
+
+@bot.tree.command(name="upcoming", description="Affiche les anniversaires des prochains jours")
+@discord.app_commands.guild_only()
+@discord.app_commands.describe(days="Nombre de jours à afficher")
+@discord.app_commands.rename(days="jours")
+async def slash_upcoming(interaction: discord.Interaction, days: discord.app_commands.Range[int, 1, UPCOMING_MAX_DAYS] = UPCOMING_DEFAULT_DAYS):
+    await interaction.response.defer(thinking=True)
+    content, embed = await upcoming_birthdays(interaction.guild, days)
+    await interaction.followup.send(content, embed=embed)
 
-    embed.add_field(name="!set-anniv <JJ/MM/YYYY>", value="Enregistre ton anniversaire.", inline=False)
-    embed.add_field(name="!list-anniv", value="Affiche les anniversaires enregistrés sur ce serveur.", inline=False)
-    embed.add_field(name="!help", value="Affiche cette aide.", inline=False)
+@bot.tree.command(name="help", description="Affiche les commandes disponibles")
+async def slash_help(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=help_embed(), ephemeral=True)
 
-    await ctx.send(embed=embed)
 discord_token = os.getenv('DISCORD_TOKEN')
 
 if discord_token:
+    metrics.start_exporter(int(os.getenv('BOT_METRICS_PORT', '9100')))
     bot.run(discord_token)
 else:
     print("Erreur : Le token du bot n'a pas été trouvé. Assurez-vous que la variable d'environnement 'DISCORD_TOKEN' est bien définie.", flush=True)
@@ -0,0 +1,60 @@
+# cache.py
+# Cache async en mémoire avec expiration (TTL) et taille bornée (LRU).
+# Les requêtes concurrentes sur une même clé absente sont regroupées en un seul appel.
+# Une invalidation pendant un chargement le détache de la clé : son résultat n'est pas mis en cache.
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class AsyncTTLCache:
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # {key: (expire_at, value)}
+        self.inflight = {}  # {key: asyncio.Task}, le chargement en cours qui alimentera le cache
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_fetch(self, key, fetch):
+        """Retourne la valeur en cache, ou appelle `fetch()` (fonction async) et met le résultat en cache."""
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            self.inflight[key] = task
+        # shield : l'annulation d'un appelant n'annule pas le fetch partagé
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, fetch):
+        try:
+            value = await fetch()
+            # Détaché par une invalidation (ou remplacé par un chargement plus récent) :
+            # la valeur peut précéder la modification
+            if self.inflight.get(key) is asyncio.current_task():
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            return value
+        finally:
+            if self.inflight.get(key) is asyncio.current_task():
+                del self.inflight[key]
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+        # Les appels suivants lancent un nouveau chargement ; celui en cours sert encore ses appelants
+        self.inflight.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        for key in [k for k in (*self.entries, *self.inflight) if predicate(k)]:
+            self.invalidate(key)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
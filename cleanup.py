@@ -0,0 +1,164 @@
+# cleanup.py
+# Départs des membres et des serveurs, et purge des données qui ne concernent plus personne.
+# Un départ ne supprime rien tout de suite : les anniversaires sont marqués (left_at) et ignorés
+# par le traitement quotidien, puis supprimés après la durée de rétention. Un membre qui revient
+# (ou un serveur qui réinvite le bot) avant la purge retrouve ses anniversaires.
+# Les événements de départ et d'arrivée sont regroupés : une requête par lot, pas une par événement.
+import asyncio
+import os
+
+import database as db
+
+# Rétention (jours) avant suppression définitive
+MEMBER_RETENTION_DAYS = int(os.getenv("MEMBER_RETENTION_DAYS", "30"))
+GUILD_RETENTION_DAYS = int(os.getenv("GUILD_RETENTION_DAYS", "30"))
+# Suivi du traitement quotidien (birthday_runs) : doit couvrir BIRTHDAY_CATCH_UP_DAYS
+RUN_HISTORY_DAYS = int(os.getenv("RUN_HISTORY_DAYS", "30"))
+
+FLUSH_DELAY = float(os.getenv("DEPARTURE_FLUSH_DELAY", "10"))  # secondes d'attente avant l'envoi d'un lot
+BATCH_SIZE = int(os.getenv("DEPARTURE_BATCH_SIZE", "500"))  # un lot plein est envoyé sans attendre
+RETRY_DELAY = 30
+
+# Au-delà de cette proportion de serveurs absents, la liste des serveurs est jugée incomplète
+# (gateway partiellement chargée, panne Discord...) et aucun serveur n'est marqué comme quitté
+MAX_MISSING_GUILDS_RATIO = 0.5
+
+
+class MembershipChanges:
+    """Départs et retours de membres en attente, envoyés à la base par lots."""
+
+    def __init__(self, delay=FLUSH_DELAY, batch_size=BATCH_SIZE):
+        self.delay = delay
+        self.batch_size = batch_size
+        self.left = set()  # {(guild_id, member_id)}
+        self.returned = set()
+        self._timer = None  # envoi différé (FLUSH_DELAY)
+        self._immediate = None  # envoi d'un lot plein
+        self._tasks = set()
+        self._lock = asyncio.Lock()
+
+    def member_left(self, guild_id, member_id):
+        key = (guild_id, member_id)
+        self.returned.discard(key)
+        self.left.add(key)
+        self._schedule()
+
+    def member_returned(self, guild_id, member_id):
+        key = (guild_id, member_id)
+        # Parti puis revenu avant l'envoi du lot : rien n'a encore été écrit, mais le membre
+        # a pu être marqué par un lot précédent
+        self.left.discard(key)
+        self.returned.add(key)
+        self._schedule()
+
+    def forget_guild(self, guild_id):
+        """Serveur quitté : ses changements en attente sont couverts par db.mark_guild_left."""
+        self.left = {key for key in self.left if key[0] != guild_id}
+        self.returned = {key for key in self.returned if key[0] != guild_id}
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        if len(self.left) + len(self.returned) >= self.batch_size:
+            if self._immediate is None or self._immediate.done():
+                self._immediate = loop.create_task(self._flush_later(0))
+                self._track(self._immediate)
+        elif self._timer is None or self._timer.done():
+            self._timer = loop.create_task(self._flush_later(self.delay))
+            self._track(self._timer)
+
+    def _track(self, task):
+        # Référence gardée jusqu'à la fin de la tâche (sinon elle peut être collectée en cours d'exécution)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        # Les changements reçus pendant l'envoi programment un nouveau lot
+        current = asyncio.current_task()
+        if self._timer is current:
+            self._timer = None
+        if self._immediate is current:
+            self._immediate = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Erreur lors de l'enregistrement des départs de membres, retry dans {RETRY_DELAY}s... Erreur: {e}", flush=True)
+            await asyncio.sleep(RETRY_DELAY)
+            if self.left or self.returned:
+                self._schedule()
+
+    async def flush(self):
+        """Envoie les changements en attente ; en cas d'erreur, ils restent en attente."""
+        async with self._lock:
+            left, self.left = self.left, set()
+            returned, self.returned = self.returned, set()
+            try:
+                marked = await db.mark_members_left(list(left)) if left else 0
+                left = set()
+                restored = await db.mark_members_returned(list(returned)) if returned else 0
+            except Exception:
+                # Les événements reçus entre-temps sont plus récents que ceux du lot
+                self.left |= {key for key in left if key not in self.returned}
+                self.returned |= {key for key in returned if key not in self.left}
+                raise
+            if marked or restored:
+                print(f"Départs de membres : {marked} anniversaire(s) mis en attente de purge, {restored} réactivé(s).", flush=True)
+
+
+def in_shards(guild_id, shards):
+    """True si le serveur est géré par ces shards ((shard_ids, shard_count), None = tous)."""
+    if shards is None:
+        return True
+    shard_ids, shard_count = shards
+    return (guild_id >> 22) % shard_count in shard_ids
+
+
+async def find_departures(bot, changes, shards=None, members_cached=True):
+    """Rattrape les départs et retours survenus pendant un arrêt du bot (aucun événement reçu),
+    ou dont l'enregistrement a échoué.
+
+    Serveurs de ces shards présents en base mais plus dans la liste du bot : marqués comme quittés ;
+    serveurs marqués comme quittés mais de nouveau dans la liste (réinvitation) : réactivés.
+    members_cached : avec le cache complet des membres, les membres absents des serveurs chargés
+    sont aussi marqués comme partis, et les membres marqués de nouveau présents réactivés.
+    """
+    # Avant la purge : un serveur réinvité ne doit pas perdre ses données
+    for guild_id in await db.get_departed_guild_ids():
+        if in_shards(guild_id, shards) and bot.get_guild(guild_id) is not None:
+            await db.mark_guild_returned(guild_id)
+            print(f"Bot réinvité sur le serveur {guild_id} pendant l'arrêt : anniversaires réactivés.", flush=True)
+
+    known = [guild_id for guild_id in await db.get_known_guild_ids() if in_shards(guild_id, shards)]
+    missing = [guild_id for guild_id in known if bot.get_guild(guild_id) is None]
+    if missing and len(missing) > len(known) * MAX_MISSING_GUILDS_RATIO:
+        print(f"{len(missing)} serveurs sur {len(known)} absents : liste des serveurs incomplète, aucun marqué comme quitté.", flush=True)
+    else:
+        for guild_id in missing:
+            await db.mark_guild_left(guild_id)
+        if missing:
+            print(f"{len(missing)} serveur(s) quitté(s) pendant l'arrêt, données en attente de purge.", flush=True)
+
+    if not members_cached:
+        return
+    for guild in list(bot.guilds):
+        if not guild.chunked or not in_shards(guild.id, shards):
+            continue
+        for member_id, left in (await db.get_guild_member_states(guild.id)).items():
+            present = guild.get_member(member_id) is not None
+            if present and left:
+                changes.member_returned(guild.id, member_id)
+            elif not present and not left:
+                changes.member_left(guild.id, member_id)
+        await asyncio.sleep(0)
+    await changes.flush()
+
+
+async def purge():
+    """Suppression définitive des données dont la rétention est écoulée."""
+    purged = await db.purge_departed(MEMBER_RETENTION_DAYS, GUILD_RETENTION_DAYS, RUN_HISTORY_DAYS)
+    print(
+        f"Purge : {purged['members']} anniversaire(s), {purged['guilds']} serveur(s), "
+        f"{purged['runs']} suivi(s) quotidien(s) supprimés.",
+        flush=True
+    )
+    return purged
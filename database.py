@@ -1,97 +1,884 @@
 import os
+import asyncio
+import calendar
+import json
+from datetime import date, timedelta
 import asyncpg
+import metrics
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 pool: asyncpg.pool.Pool | None = None
+_connect_lock = asyncio.Lock()
 
-# Connexion à PostgreSQL avec pool
+DEFAULT_TIMEZONE = "Europe/Paris"
+
+# Canal NOTIFY signalant une modification des paramètres d'un serveur (payload : guild_id)
+SETTINGS_CHANNEL = "guild_settings_changed"
+# Canal NOTIFY signalant une modification des anniversaires d'un serveur (payload : guild_id)
+BIRTHDAYS_CHANNEL = "guild_birthdays_changed"
+
+# Réglages du pool (par process)
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+# Cache de requêtes préparées d'asyncpg ; 0 derrière PgBouncer en mode transaction
+# (les requêtes fréquentes ne sont alors pas préparées non plus)
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+PREPARE_HOT_QUERIES = STATEMENT_CACHE_SIZE > 0
+
+# Délais (secondes) : requêtes courantes, requêtes sans délai explicite, opérations en masse, connexion
+QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "5"))
+COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+BULK_TIMEOUT = float(os.getenv("DB_BULK_TIMEOUT", "300"))
+CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", "10"))
+CONNECT_RETRY_DELAY = float(os.getenv("DB_CONNECT_RETRY_DELAY", "3"))
+
+# Requêtes les plus fréquentes (commandes, dashboard, traitement quotidien), préparées une fois par connexion
+HOT_QUERIES = {
+    "add_birthday": """
+    INSERT INTO birthdays (guild_id, member_id, birthday_date)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (guild_id, member_id) DO UPDATE SET birthday_date = EXCLUDED.birthday_date, left_at = NULL
+    """,
+    "get_birthday": "SELECT birthday_date FROM birthdays WHERE guild_id = $1 AND member_id = $2",
+    "get_guild_settings": "SELECT role_id, channel_id, birthday_message, timezone FROM guild_settings WHERE guild_id = $1",
+    "get_guild_settings_many": """
+    SELECT guild_id, role_id, channel_id, birthday_message, timezone
+    FROM guild_settings
+    WHERE guild_id = ANY($1::BIGINT[])
+    """,
+    "count_guild_birthdays": "SELECT count(*) FROM birthdays WHERE guild_id = $1 AND left_at IS NULL",
+    "load_web_session": "SELECT data FROM web_sessions WHERE id = $1 AND expires_at > now()",
+}
+
+
+class Connection(asyncpg.Connection):
+    """Connexion du pool, avec ses requêtes fréquentes préparées (prepared[nom])."""
+    __slots__ = ("prepared",)
+
+
+async def prepare_hot_queries(conn):
+    conn.prepared = {}
+    if PREPARE_HOT_QUERIES:
+        for name, query in HOT_QUERIES.items():
+            conn.prepared[name] = await conn.prepare(query)
+
+
+async def run_hot(conn, name, method, *args):
+    """Exécute une requête de HOT_QUERIES (method : fetch, fetchrow ou fetchval) avec le délai QUERY_TIMEOUT."""
+    statement = conn.prepared.get(name)
+    if statement is not None:
+        return await getattr(statement, method)(*args, timeout=QUERY_TIMEOUT)
+    return await getattr(conn, method)(HOT_QUERIES[name], *args, timeout=QUERY_TIMEOUT)
+
+
+# Connexion à PostgreSQL avec pool (idempotent : sans effet si le pool existe déjà)
 async def connect():
     global pool
-    print("Connexion à PostgreSQL...", flush=True)
-    pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=10)
-    print("Connecté à PostgreSQL.", flush=True)
+    async with _connect_lock:
+        if pool is not None:
+            return
+        print("Connexion à PostgreSQL...", flush=True)
+        # Le schéma doit exister avant de préparer les requêtes sur les connexions du pool
+        conn = await asyncpg.connect(DATABASE_URL, timeout=CONNECT_TIMEOUT)
+        try:
+            await create_tables(conn)
+        finally:
+            await conn.close()
 
-# Création des tables
-async def create_tables():
-    async with pool.acquire() as conn:
-        query = """
-        CREATE TABLE IF NOT EXISTS birthdays (
-            guild_id BIGINT NOT NULL,
-            member_id BIGINT NOT NULL,
-            birthday_date DATE NOT NULL,
-            PRIMARY KEY (guild_id, member_id)
-        );
-
-        CREATE TABLE IF NOT EXISTS guild_settings (
-            guild_id BIGINT PRIMARY KEY,
-            role_id BIGINT,
-            channel_id BIGINT,
-            birthday_message TEXT
-        );
-        """
-        await conn.execute(query)
-        print("Tables créées.", flush=True)
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=POOL_MAX_INACTIVE_LIFETIME,
+            statement_cache_size=STATEMENT_CACHE_SIZE,
+            command_timeout=COMMAND_TIMEOUT,
+            timeout=CONNECT_TIMEOUT,
+            connection_class=Connection,
+            init=prepare_hot_queries,
+        )
+        print("Connecté à PostgreSQL.", flush=True)
+
+# Connexion au démarrage, en attendant que PostgreSQL soit prêt (bot et dashboard)
+async def connect_with_retry(attempts=CONNECT_ATTEMPTS, delay=CONNECT_RETRY_DELAY):
+    for i in range(attempts):
+        try:
+            await connect()
+            return
+        except Exception as e:
+            print(f"DB non prête, retry dans {delay:g}s... ({i+1}/{attempts}) Erreur: {e}", flush=True)
+            await asyncio.sleep(delay)
+    raise ConnectionError(f"Impossible de se connecter à PostgreSQL après {attempts} essais")
+
+async def close():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+# Sonde de vivacité : True si une connexion du pool répond dans le délai
+async def ping(timeout=2.0):
+    if pool is None:
+        return False
+    try:
+        async with asyncio.timeout(timeout):
+            async with pool.acquire() as conn:
+                return await conn.fetchval("SELECT 1") == 1
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+        return False
+
+# Connexion dédiée (hors pool) à l'écoute d'un canal NOTIFY : callback(payload) à chaque notification,
+# on_lost() si la connexion est perdue
+async def listen(channel, callback, on_lost):
+    conn = await asyncpg.connect(DATABASE_URL)
+    conn.add_termination_listener(lambda _conn: on_lost())
+    await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+    return conn
+
+# Acquisition d'une connexion du pool (attente et connexions utilisées mesurées si les métriques sont activées)
+def acquire():
+    return metrics.timed_acquire(pool) if metrics.ENABLED else pool.acquire()
+
+# Création des tables (sur `conn`, ou une connexion du pool)
+async def create_tables(conn=None):
+    if conn is None:
+        async with acquire() as conn:
+            return await create_tables(conn)
 
-# Ajouter ou mettre à jour un anniversaire
-async def add_birthday(guild_id, member_id, birthday_date):
     query = """
-    INSERT INTO birthdays (guild_id, member_id, birthday_date)
-    VALUES ($1, $2, $3)
-    ON CONFLICT (guild_id, member_id) DO UPDATE SET birthday_date = EXCLUDED.birthday_date
+    CREATE TABLE IF NOT EXISTS birthdays (
+        guild_id BIGINT NOT NULL,
+        member_id BIGINT NOT NULL,
+        birthday_date DATE NOT NULL,
+        PRIMARY KEY (guild_id, member_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS guild_settings (
+        guild_id BIGINT PRIMARY KEY,
+        role_id BIGINT,
+        channel_id BIGINT,
+        birthday_message TEXT
+    );
+
+    -- Clé jour/mois indexée (MMJJ) pour éviter le scan complet à minuit
+    ALTER TABLE birthdays ADD COLUMN IF NOT EXISTS birthday_key SMALLINT
+        GENERATED ALWAYS AS (
+            (EXTRACT(MONTH FROM birthday_date) * 100 + EXTRACT(DAY FROM birthday_date))::SMALLINT
+        ) STORED;
+
+    -- Membres partis : conservés left_at jours (voir cleanup.py), ignorés par le traitement quotidien
+    ALTER TABLE birthdays ADD COLUMN IF NOT EXISTS left_at TIMESTAMPTZ;
+
+    -- L'index lu à minuit ne contient que les membres présents
+    CREATE INDEX IF NOT EXISTS birthdays_live_key_idx ON birthdays (birthday_key) WHERE left_at IS NULL;
+    DROP INDEX IF EXISTS birthdays_birthday_key_idx;
+
+    -- Purge des membres partis depuis plus longtemps que la rétention
+    CREATE INDEX IF NOT EXISTS birthdays_left_at_idx ON birthdays (left_at) WHERE left_at IS NOT NULL;
+
+    -- Parcours des anniversaires d'un serveur dans l'ordre du calendrier (pagination par clé)
+    CREATE INDEX IF NOT EXISTS birthdays_guild_key_idx ON birthdays (guild_id, birthday_key, member_id);
+
+    -- Fuseau horaire de chaque serveur (les anniversaires sont fêtés à minuit heure locale)
+    ALTER TABLE guild_settings ADD COLUMN IF NOT EXISTS timezone TEXT NOT NULL DEFAULT 'Europe/Paris';
+
+    CREATE INDEX IF NOT EXISTS guild_settings_timezone_idx ON guild_settings (timezone);
+
+    -- Suivi par serveur et par date des étapes du traitement quotidien (idempotence / reprise)
+    CREATE TABLE IF NOT EXISTS birthday_runs (
+        guild_id BIGINT NOT NULL,
+        run_date DATE NOT NULL,
+        announced_at TIMESTAMPTZ,
+        roles_added_at TIMESTAMPTZ,
+        roles_removed_at TIMESTAMPTZ,
+        PRIMARY KEY (guild_id, run_date)
+    );
+
+    -- Dernière date locale traitée par fuseau horaire (rattrapage après une interruption)
+    CREATE TABLE IF NOT EXISTS birthday_schedule (
+        timezone TEXT PRIMARY KEY,
+        last_run_date DATE NOT NULL
+    );
+
+    -- Un curseur par fuseau et par shard : chaque process ne fait avancer que les shards qu'il gère
+    ALTER TABLE birthday_schedule ADD COLUMN IF NOT EXISTS shard_id INT NOT NULL DEFAULT 0;
+
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.key_column_usage
+            WHERE table_name = 'birthday_schedule'
+            AND constraint_name = 'birthday_schedule_pkey'
+            AND column_name = 'shard_id'
+        ) THEN
+            ALTER TABLE birthday_schedule DROP CONSTRAINT birthday_schedule_pkey;
+            ALTER TABLE birthday_schedule ADD PRIMARY KEY (timezone, shard_id);
+        END IF;
+    END $$;
+
+    -- Purge de l'historique du traitement quotidien
+    CREATE INDEX IF NOT EXISTS birthday_runs_run_date_idx ON birthday_runs (run_date);
+
+    -- Tentatives d'annonce : réservation (expirée après ANNOUNCE_RETRY_DELAY) et nombre d'essais
+    ALTER TABLE birthday_runs ADD COLUMN IF NOT EXISTS announce_attempted_at TIMESTAMPTZ;
+    ALTER TABLE birthday_runs ADD COLUMN IF NOT EXISTS announce_attempts INT NOT NULL DEFAULT 0;
+
+    -- Serveurs quittés par le bot : données conservées jusqu'à la purge, au cas où le bot y serait réinvité
+    CREATE TABLE IF NOT EXISTS departed_guilds (
+        guild_id BIGINT PRIMARY KEY,
+        left_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    -- Sessions du dashboard (voir sessions.py)
+    CREATE TABLE IF NOT EXISTS web_sessions (
+        id TEXT PRIMARY KEY,
+        data JSONB NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS web_sessions_expires_at_idx ON web_sessions (expires_at);
     """
-    async with pool.acquire() as conn:
-        await conn.execute(query, guild_id, member_id, birthday_date)
+    await conn.execute(query)
+    print("Tables créées.", flush=True)
+
+# Notifie une modification des anniversaires de ces serveurs (pages mises en cache par le bot, voir
+# BirthdayPaginator) ; dans une transaction, la notification n'est délivrée qu'au commit
+async def notify_birthdays_changed(conn, guild_ids):
+    await conn.execute(
+        "SELECT pg_notify($1, g::TEXT) FROM unnest($2::BIGINT[]) AS g", BIRTHDAYS_CHANNEL, list(set(guild_ids))
+    )
+
+# Ajouter ou mettre à jour un anniversaire
+@metrics.timed_db
+async def add_birthday(guild_id, member_id, birthday_date):
+    async with acquire() as conn:
+        await run_hot(conn, "add_birthday", "fetch", guild_id, member_id, birthday_date)
+        await notify_birthdays_changed(conn, [guild_id])
+
+# Récupérer l'anniversaire d'un membre
+@metrics.timed_db
+async def get_birthday(guild_id, member_id):
+    async with acquire() as conn:
+        return await run_hot(conn, "get_birthday", "fetchval", guild_id, member_id)
 
 # Récupérer les paramètres d'un serveur
+@metrics.timed_db
 async def get_guild_settings(guild_id):
-    query = "SELECT role_id, channel_id, birthday_message FROM guild_settings WHERE guild_id = $1"
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(query, guild_id)
+    async with acquire() as conn:
+        row = await run_hot(conn, "get_guild_settings", "fetchrow", guild_id)
     return dict(row) if row else None
 
+# Récupérer les paramètres de plusieurs serveurs en une seule requête
+@metrics.timed_db
+async def get_guild_settings_many(guild_ids):
+    async with acquire() as conn:
+        rows = await run_hot(conn, "get_guild_settings_many", "fetch", list(guild_ids))
+    # On retourne un dict {guild_id: settings}
+    return {
+        r["guild_id"]: {
+            "role_id": r["role_id"],
+            "channel_id": r["channel_id"],
+            "birthday_message": r["birthday_message"],
+            "timezone": r["timezone"],
+        }
+        for r in rows
+    }
+
+# Fuseaux horaires utilisés par au moins un serveur
+@metrics.timed_db
+async def get_guild_timezones():
+    query = """
+    SELECT DISTINCT timezone FROM guild_settings s
+    WHERE NOT EXISTS (SELECT 1 FROM departed_guilds d WHERE d.guild_id = s.guild_id)
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query)
+    return [r["timezone"] for r in rows]
+
 # Mettre à jour les paramètres d'un serveur
-async def update_guild_settings(guild_id, role_id, channel_id, message):
+# (timezone=None conserve le fuseau déjà enregistré)
+@metrics.timed_db
+async def update_guild_settings(guild_id, role_id, channel_id, message, timezone=None):
     query = """
-    INSERT INTO guild_settings (guild_id, role_id, channel_id, birthday_message)
-    VALUES ($1, $2, $3, $4)
+    INSERT INTO guild_settings (guild_id, role_id, channel_id, birthday_message, timezone)
+    VALUES ($1, $2, $3, $4, COALESCE($5, 'Europe/Paris'))
     ON CONFLICT (guild_id) DO UPDATE 
     SET role_id = EXCLUDED.role_id,
         channel_id = EXCLUDED.channel_id,
-        birthday_message = EXCLUDED.birthday_message
-    """
-    async with pool.acquire() as conn:
-        await conn.execute(
-            query,
-            int(guild_id) if guild_id else None,
-            int(role_id) if role_id else None,
-            int(channel_id) if channel_id else None,
-            message
-        )
+        birthday_message = EXCLUDED.birthday_message,
+        timezone = COALESCE($5, guild_settings.timezone)
+    """
+    async with acquire() as conn:
+        # La notification n'est délivrée qu'au commit, en même temps que la modification
+        async with conn.transaction():
+            await conn.execute(
+                query,
+                int(guild_id) if guild_id else None,
+                int(role_id) if role_id else None,
+                int(channel_id) if channel_id else None,
+                message,
+                timezone
+            )
+            await conn.execute("SELECT pg_notify($1, $2)", SETTINGS_CHANNEL, str(guild_id))
+
+# Clés MMJJ correspondant à une date (les 29/02 sont fêtés le 28/02 les années non bissextiles)
+def birthday_keys(some_date):
+    keys = [some_date.month * 100 + some_date.day]
+    if some_date.month == 2 and some_date.day == 28 and not calendar.isleap(some_date.year):
+        keys.append(229)
+    return keys
+
+# Date du prochain anniversaire une année donnée (le 29/02 est fêté le 28/02 les années non bissextiles)
+def birthday_in_year(birthday_date, year):
+    if birthday_date.month == 2 and birthday_date.day == 29 and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return birthday_date.replace(year=year)
+
+# Condition SQL limitant `column` aux serveurs des shards (shard_ids, shard_count) ; complète args
+def shard_condition(column, shards, args):
+    shard_ids, shard_count = shards
+    args.extend([list(shard_ids), shard_count])
+    # Formule de Discord : shard_id = (guild_id >> 22) % shard_count
+    return f"(({column} >> 22) % ${len(args)}) = ANY(${len(args) - 1}::INT[])"
 
 # Récupérer les anniversaires d'une date spécifique
-async def get_birthdays_on_date(some_date):
-    query = """
-    SELECT guild_id, member_id
-    FROM birthdays
-    WHERE EXTRACT(MONTH FROM birthday_date) = $1
-    AND EXTRACT(DAY FROM birthday_date) = $2;
-    """
-    
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query, some_date.month, some_date.day)
+# (timezones : limite aux serveurs configurés dans ces fuseaux horaires ;
+#  shards : (shard_ids, shard_count), limite aux serveurs gérés par ces shards)
+@metrics.timed_db
+async def get_birthdays_on_date(some_date, timezones=None, shards=None):
+    conditions = ["b.birthday_key = ANY($1::SMALLINT[])", "b.left_at IS NULL"]
+    args = [birthday_keys(some_date)]
+    join = ""
+
+    if timezones is not None:
+        join = "JOIN guild_settings s ON s.guild_id = b.guild_id"
+        args.append(list(timezones))
+        conditions.append(f"s.timezone = ANY(${len(args)}::TEXT[])")
+
+    if shards is not None:
+        conditions.append(shard_condition("b.guild_id", shards, args))
+
+    query = f"""
+    SELECT b.guild_id, b.member_id
+    FROM birthdays b
+    {join}
+    WHERE {' AND '.join(conditions)};
+    """
+
+    async with acquire() as conn:
+        rows = await conn.fetch(query, *args)
     return [{"guild_id": r["guild_id"], "member_id": r["member_id"]} for r in rows]
 
 
-async def get_all_guild_birthdays(guild_id):
-    query = "SELECT member_id, birthday_date FROM birthdays WHERE guild_id = $1"
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query, guild_id)
-    # On retourne un dict {member_id: birthday_date}
-    return {str(r["member_id"]): str(r["birthday_date"]) for r in rows}
+# Membres d'un serveur dont c'est l'anniversaire à une date
+@metrics.timed_db
+async def get_guild_birthdays_on_date(guild_id, some_date):
+    query = """
+    SELECT member_id FROM birthdays
+    WHERE guild_id = $1 AND birthday_key = ANY($2::SMALLINT[]) AND left_at IS NULL
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, guild_id, birthday_keys(some_date))
+    return [r["member_id"] for r in rows]
+
+# Serveurs ayant un rôle d'anniversaire configuré, pour des fuseaux horaires (et des shards) donnés
+@metrics.timed_db
+async def get_role_guilds(timezones, shards=None):
+    args = [list(timezones)]
+    conditions = [
+        "role_id IS NOT NULL",
+        "timezone = ANY($1::TEXT[])",
+        "NOT EXISTS (SELECT 1 FROM departed_guilds d WHERE d.guild_id = s.guild_id)",
+    ]
+    if shards is not None:
+        conditions.append(shard_condition("guild_id", shards, args))
+    query = f"SELECT guild_id FROM guild_settings s WHERE {' AND '.join(conditions)}"
+    async with acquire() as conn:
+        rows = await conn.fetch(query, *args)
+    return [r["guild_id"] for r in rows]
+
+
+# Une page des anniversaires d'un serveur (membres partis compris), par member_id croissant après `after` :
+# parcours de la clé primaire (guild_id, member_id), coût proportionnel à la page
+@metrics.timed_db
+async def get_guild_birthdays_page(guild_id, after=0, limit=5000):
+    query = """
+    SELECT member_id, birthday_date FROM birthdays
+    WHERE guild_id = $1 AND member_id > $2
+    ORDER BY member_id
+    LIMIT $3
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, guild_id, after, limit)
+    return [(r["member_id"], r["birthday_date"]) for r in rows]
+
+
+# Nombre d'anniversaires enregistrés sur un serveur
+@metrics.timed_db
+async def count_guild_birthdays(guild_id):
+    async with acquire() as conn:
+        return await run_hot(conn, "count_guild_birthdays", "fetchval", guild_id)
 
 
+# Une page d'anniversaires triés par prochain anniversaire à partir de `today`.
+# Pagination par clé avec un curseur (wrapped, birthday_key, member_id) ; wrapped = l'anniversaire tombe l'année suivante.
+#   after  : page qui suit ce curseur (None pour la première page)
+#   before : page qui précède ce curseur (pour revenir en arrière sans état)
+@metrics.timed_db
+async def get_upcoming_birthdays_page(guild_id, today, after=None, before=None, limit=15):
+    today_key = today.month * 100 + today.day
+    if before:
+        wrapped, cursor_key, cursor_member = before
+        query = """
+        SELECT * FROM (
+            (SELECT member_id, birthday_date, birthday_key, FALSE AS wrapped
+             FROM birthdays
+             WHERE guild_id = $1 AND birthday_key >= $2 AND left_at IS NULL
+             AND ($3 OR (birthday_key, member_id) < ($4, $5))
+             ORDER BY birthday_key DESC, member_id DESC
+             LIMIT $6)
+            UNION ALL
+            (SELECT member_id, birthday_date, birthday_key, TRUE AS wrapped
+             FROM birthdays
+             WHERE guild_id = $1 AND birthday_key < $2 AND $3 AND left_at IS NULL
+             AND (birthday_key, member_id) < ($4, $5)
+             ORDER BY birthday_key DESC, member_id DESC
+             LIMIT $6)
+        ) page
+        ORDER BY wrapped DESC, birthday_key DESC, member_id DESC
+        LIMIT $6
+        """
+    else:
+        wrapped, cursor_key, cursor_member = after if after else (False, today_key, -1)
+        query = """
+        SELECT * FROM (
+            (SELECT member_id, birthday_date, birthday_key, FALSE AS wrapped
+             FROM birthdays
+             WHERE guild_id = $1 AND birthday_key >= $2 AND NOT $3 AND left_at IS NULL
+             AND (birthday_key, member_id) > ($4, $5)
+             ORDER BY birthday_key, member_id
+             LIMIT $6)
+            UNION ALL
+            (SELECT member_id, birthday_date, birthday_key, TRUE AS wrapped
+             FROM birthdays
+             WHERE guild_id = $1 AND birthday_key < $2 AND left_at IS NULL
+             AND (NOT $3 OR (birthday_key, member_id) > ($4, $5))
+             ORDER BY birthday_key, member_id
+             LIMIT $6)
+        ) page
+        ORDER BY wrapped, birthday_key, member_id
+        LIMIT $6
+        """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, guild_id, today_key, wrapped, cursor_key, cursor_member, limit)
+    rows = [dict(r) for r in rows]
+    return rows[::-1] if before else rows
+
+# Anniversaires des `days` prochains jours à partir de `today` inclus, dans l'ordre du calendrier
+# (au plus `limit`). Lecture de l'index (guild_id, birthday_key, member_id) par plage de clés MMJJ,
+# en deux parcours si la période passe le 31/12 : le coût dépend du nombre de résultats, pas de la taille du serveur.
+@metrics.timed_db
+async def get_upcoming_birthdays(guild_id, today, days=7, limit=25):
+    days = max(1, min(days, 365))
+    end = today + timedelta(days=days - 1)
+    start_key = today.month * 100 + today.day
+    end_key = max(birthday_keys(end))  # inclut les 29/02 si la période finit un 28/02 non bissextile
+    wraps = end.year != today.year
+    query = """
+    SELECT * FROM (
+        (SELECT member_id, birthday_date, birthday_key, FALSE AS wrapped
+         FROM birthdays
+         WHERE guild_id = $1 AND birthday_key BETWEEN $2 AND $3 AND left_at IS NULL
+         ORDER BY birthday_key, member_id
+         LIMIT $6)
+        UNION ALL
+        (SELECT member_id, birthday_date, birthday_key, TRUE AS wrapped
+         FROM birthdays
+         WHERE guild_id = $1 AND $4 AND birthday_key <= $5 AND left_at IS NULL
+         ORDER BY birthday_key, member_id
+         LIMIT $6)
+    ) upcoming
+    ORDER BY wrapped, birthday_key, member_id
+    LIMIT $6
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, guild_id, start_key, 1231 if wraps else end_key, wraps, end_key, limit)
+
+    upcoming = []
+    for r in rows:
+        next_birthday = birthday_in_year(r["birthday_date"], today.year + r["wrapped"])
+        upcoming.append({
+            "member_id": r["member_id"],
+            "birthday_date": r["birthday_date"],
+            "next_birthday": next_birthday,
+            "days_until": (next_birthday - today).days,
+            "age": next_birthday.year - r["birthday_date"].year,
+        })
+    return upcoming
+
 # Supprimer un anniversaire
+@metrics.timed_db
 async def delete_birthday(guild_id, member_id):
     query = "DELETE FROM birthdays WHERE guild_id = $1 AND member_id = $2"
-    async with pool.acquire() as conn:
+    async with acquire() as conn:
         await conn.execute(query, guild_id, member_id)
+        await notify_birthdays_changed(conn, [guild_id])
+
+
+# Modifications groupées depuis le dashboard, appliquées dans une seule transaction :
+# upserts [(member_id, date)] et suppressions [member_id] (un membre au plus une fois par lot).
+# Retourne (nombre d'upserts, nombre de suppressions).
+@metrics.timed_db
+async def apply_birthday_changes(guild_id, upserts, deletes):
+    upserted = deleted = "X 0"
+    async with acquire() as conn:
+        async with conn.transaction():
+            if upserts:
+                upserted = await conn.execute("""
+                INSERT INTO birthdays (guild_id, member_id, birthday_date)
+                SELECT $1::BIGINT, member_id, birthday_date
+                FROM unnest($2::BIGINT[], $3::DATE[]) AS changes(member_id, birthday_date)
+                ON CONFLICT (guild_id, member_id) DO UPDATE SET birthday_date = EXCLUDED.birthday_date, left_at = NULL
+                """, guild_id, [m for m, _ in upserts], [d for _, d in upserts], timeout=QUERY_TIMEOUT)
+            if deletes:
+                deleted = await conn.execute(
+                    "DELETE FROM birthdays WHERE guild_id = $1 AND member_id = ANY($2::BIGINT[])",
+                    guild_id, list(deletes), timeout=QUERY_TIMEOUT
+                )
+            await notify_birthdays_changed(conn, [guild_id])
+    # statuts "INSERT 0 <n>" / "DELETE <n>"
+    return int(upserted.split()[-1]), int(deleted.split()[-1])
+
+
+# Import en masse : COPY dans une table temporaire puis un seul upsert
+# (records : [(member_id, date)] ; si un membre apparaît plusieurs fois, sa dernière ligne l'emporte)
+@metrics.timed_db
+async def import_birthdays(guild_id, records):
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+            CREATE TEMP TABLE birthdays_import (
+                seq INT NOT NULL,
+                member_id BIGINT NOT NULL,
+                birthday_date DATE NOT NULL
+            ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                "birthdays_import",
+                # seq : position dans le fichier
+                records=((seq, member_id, birthday_date) for seq, (member_id, birthday_date) in enumerate(records)),
+                columns=["seq", "member_id", "birthday_date"],
+                timeout=BULK_TIMEOUT,
+            )
+            # DISTINCT ON : un seul upsert par membre si le fichier contient des doublons, la dernière ligne du membre
+            result = await conn.execute("""
+            INSERT INTO birthdays (guild_id, member_id, birthday_date)
+            SELECT DISTINCT ON (member_id) $1::BIGINT, member_id, birthday_date
+            FROM birthdays_import
+            ORDER BY member_id, seq DESC
+            ON CONFLICT (guild_id, member_id) DO UPDATE SET birthday_date = EXCLUDED.birthday_date, left_at = NULL
+            """, guild_id, timeout=BULK_TIMEOUT)
+            await notify_birthdays_changed(conn, [guild_id])
+    # result = "INSERT 0 <n>"
+    return int(result.split()[-1])
+
+
+# Export en flux : curseur côté serveur, sans charger tout le serveur en mémoire
+async def iter_guild_birthdays(guild_id, prefetch=1000):
+    query = "SELECT member_id, birthday_date FROM birthdays WHERE guild_id = $1 ORDER BY member_id"
+    async with acquire() as conn:
+        async with conn.transaction():
+            async for r in conn.cursor(query, guild_id, prefetch=prefetch):
+                yield r["member_id"], r["birthday_date"]
+
+
+# --- Suivi du traitement quotidien ---
+RUN_STEPS = {"announced": "announced_at", "roles_added": "roles_added_at", "roles_removed": "roles_removed_at"}
+
+# Dernière date traitée par fuseau pour un ensemble de shards : {timezone: date}
+# (la plus ancienne des dates des shards, pour que chacun rattrape son retard). Un shard sans curseur
+# pour ce fuseau (nouveau shard après un changement de SHARD_COUNT) part du plus ancien curseur du fuseau,
+# tous shards confondus : ses serveurs étaient traités par un autre shard jusque-là.
+@metrics.timed_db
+async def get_schedule_cursors(shard_ids=(0,)):
+    shard_ids = sorted(set(shard_ids))
+    query = """
+    SELECT timezone,
+           MIN(last_run_date) FILTER (WHERE shard_id = ANY($1::INT[])) AS own_run_date,
+           COUNT(*) FILTER (WHERE shard_id = ANY($1::INT[])) AS own_shards,
+           MIN(last_run_date) AS earliest_run_date
+    FROM birthday_schedule
+    GROUP BY timezone
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, shard_ids)
+    return {
+        r["timezone"]: r["own_run_date"] if r["own_shards"] == len(shard_ids) else r["earliest_run_date"]
+        for r in rows
+    }
+
+# Avancer la dernière date traitée pour plusieurs fuseaux et shards (jamais en arrière)
+@metrics.timed_db
+async def set_schedule_cursor(timezones, run_date, shard_ids=(0,)):
+    query = """
+    INSERT INTO birthday_schedule (timezone, shard_id, last_run_date)
+    SELECT tz, shard_id, $3
+    FROM unnest($1::TEXT[]) AS tz CROSS JOIN unnest($2::INT[]) AS shard_id
+    ON CONFLICT (timezone, shard_id) DO UPDATE
+    SET last_run_date = GREATEST(birthday_schedule.last_run_date, EXCLUDED.last_run_date)
+    """
+    async with acquire() as conn:
+        await conn.execute(query, list(timezones), list(shard_ids), run_date)
+
+# Étapes déjà faites pour une date : {guild_id: {"announced": bool, "roles_added": bool, "roles_removed": bool}}
+@metrics.timed_db
+async def get_birthday_runs(guild_ids, run_date):
+    query = """
+    SELECT guild_id, announced_at, roles_added_at, roles_removed_at
+    FROM birthday_runs
+    WHERE guild_id = ANY($1::BIGINT[]) AND run_date = $2
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, list(guild_ids), run_date)
+    return {
+        r["guild_id"]: {
+            "announced": r["announced_at"] is not None,
+            "roles_added": r["roles_added_at"] is not None,
+            "roles_removed": r["roles_removed_at"] is not None,
+        }
+        for r in rows
+    }
+
+# Réserver l'annonce d'une date (True si ce process doit envoyer le message). La réservation expire après
+# retry_delay secondes : un envoi échoué, ou interrompu par un arrêt du bot, peut alors être retenté.
+# L'annonce n'est marquée comme faite (mark_birthday_run(..., "announced")) qu'après l'envoi du message.
+@metrics.timed_db
+async def claim_announcement(guild_id, run_date, retry_delay):
+    query = """
+    INSERT INTO birthday_runs (guild_id, run_date, announce_attempted_at, announce_attempts)
+    VALUES ($1, $2, now(), 1)
+    ON CONFLICT (guild_id, run_date) DO UPDATE
+    SET announce_attempted_at = now(), announce_attempts = birthday_runs.announce_attempts + 1
+    WHERE birthday_runs.announced_at IS NULL
+    AND (birthday_runs.announce_attempted_at IS NULL
+         OR birthday_runs.announce_attempted_at < now() - make_interval(secs => $3))
+    RETURNING guild_id
+    """
+    async with acquire() as conn:
+        row = await conn.fetchrow(query, guild_id, run_date, retry_delay)
+    return row is not None
+
+# Serveurs de ces fuseaux (et shards) dont l'annonce de run_date a échoué et peut être retentée
+# (réservation expirée, moins de max_attempts essais)
+@metrics.timed_db
+async def get_announcement_retries(run_date, timezones, retry_delay, max_attempts, shards=None):
+    args = [run_date, list(timezones), retry_delay, max_attempts]
+    conditions = [
+        "r.run_date = $1",
+        "s.timezone = ANY($2::TEXT[])",
+        "r.announced_at IS NULL",
+        "r.announce_attempts BETWEEN 1 AND $4 - 1",
+        "r.announce_attempted_at < now() - make_interval(secs => $3)",
+    ]
+    if shards is not None:
+        conditions.append(shard_condition("r.guild_id", shards, args))
+    query = f"""
+    SELECT r.guild_id
+    FROM birthday_runs r
+    JOIN guild_settings s ON s.guild_id = r.guild_id
+    WHERE {' AND '.join(conditions)}
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, *args)
+    return [r["guild_id"] for r in rows]
+
+# Marquer une ou plusieurs étapes (announced / roles_added / roles_removed) comme faites
+@metrics.timed_db
+async def mark_birthday_run(guild_id, run_date, *steps):
+    columns = [RUN_STEPS[step] for step in steps]
+    query = f"""
+    INSERT INTO birthday_runs (guild_id, run_date, {', '.join(columns)})
+    VALUES ($1, $2, {', '.join('now()' for _ in columns)})
+    ON CONFLICT (guild_id, run_date) DO UPDATE SET {', '.join(f'{c} = now()' for c in columns)}
+    """
+    async with acquire() as conn:
+        await conn.execute(query, guild_id, run_date)
+
+
+# --- Départs et purge (voir cleanup.py) ---
+# Membres partis (pairs : [(guild_id, member_id)]) : left_at posé, données conservées jusqu'à la purge
+@metrics.timed_db
+async def mark_members_left(pairs):
+    query = """
+    UPDATE birthdays b SET left_at = now()
+    FROM unnest($1::BIGINT[], $2::BIGINT[]) AS departed(guild_id, member_id)
+    WHERE b.guild_id = departed.guild_id AND b.member_id = departed.member_id AND b.left_at IS NULL
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
+            result = await conn.execute(query, [g for g, _ in pairs], [m for _, m in pairs], timeout=QUERY_TIMEOUT)
+            await notify_birthdays_changed(conn, [g for g, _ in pairs])
+    # result = "UPDATE <n>"
+    return int(result.split()[-1])
+
+# Membres revenus avant la purge : leurs anniversaires redeviennent actifs
+@metrics.timed_db
+async def mark_members_returned(pairs):
+    query = """
+    UPDATE birthdays b SET left_at = NULL
+    FROM unnest($1::BIGINT[], $2::BIGINT[]) AS returned(guild_id, member_id)
+    WHERE b.guild_id = returned.guild_id AND b.member_id = returned.member_id AND b.left_at IS NOT NULL
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
+            result = await conn.execute(query, [g for g, _ in pairs], [m for _, m in pairs], timeout=QUERY_TIMEOUT)
+            await notify_birthdays_changed(conn, [g for g, _ in pairs])
+    return int(result.split()[-1])
+
+# Serveur quitté par le bot : tous ses anniversaires sont marqués avec la date de départ du serveur
+@metrics.timed_db
+async def mark_guild_left(guild_id):
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "INSERT INTO departed_guilds (guild_id) VALUES ($1) ON CONFLICT (guild_id) DO NOTHING", guild_id
+            )
+            await conn.execute(
+                "UPDATE birthdays SET left_at = now() WHERE guild_id = $1 AND left_at IS NULL",
+                guild_id, timeout=BULK_TIMEOUT
+            )
+            await notify_birthdays_changed(conn, [guild_id])
+
+# Bot réinvité avant la purge : seuls les anniversaires marqués au départ du serveur sont réactivés
+# (now() est fixe dans une transaction : même horodatage que departed_guilds.left_at)
+@metrics.timed_db
+async def mark_guild_returned(guild_id):
+    async with acquire() as conn:
+        async with conn.transaction():
+            left_at = await conn.fetchval(
+                "DELETE FROM departed_guilds WHERE guild_id = $1 RETURNING left_at", guild_id
+            )
+            if left_at is not None:
+                await conn.execute(
+                    "UPDATE birthdays SET left_at = NULL WHERE guild_id = $1 AND left_at = $2",
+                    guild_id, left_at, timeout=BULK_TIMEOUT
+                )
+                await notify_birthdays_changed(conn, [guild_id])
+    return left_at is not None
+
+# Serveurs ayant des données en base (paramètres ou anniversaires), hors serveurs déjà quittés.
+# Les serveurs distincts de birthdays sont lus en sautant d'un serveur au suivant dans l'index
+# (guild_id, birthday_key, member_id) : une lecture par serveur plutôt qu'un parcours de la table.
+@metrics.timed_db
+async def get_known_guild_ids():
+    query = """
+    WITH RECURSIVE guilds AS (
+        (SELECT guild_id FROM birthdays ORDER BY guild_id LIMIT 1)
+        UNION ALL
+        SELECT (SELECT b.guild_id FROM birthdays b WHERE b.guild_id > g.guild_id ORDER BY b.guild_id LIMIT 1)
+        FROM guilds g
+        WHERE g.guild_id IS NOT NULL
+    )
+    SELECT guild_id FROM guilds WHERE guild_id IS NOT NULL
+    UNION
+    SELECT guild_id FROM guild_settings
+    EXCEPT
+    SELECT guild_id FROM departed_guilds
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query, timeout=BULK_TIMEOUT)
+    return [r["guild_id"] for r in rows]
+
+# Serveurs marqués comme quittés (pas encore purgés)
+@metrics.timed_db
+async def get_departed_guild_ids():
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT guild_id FROM departed_guilds")
+    return [r["guild_id"] for r in rows]
+
+# Membres ayant un anniversaire enregistré sur un serveur : {member_id: True si marqué comme parti}
+@metrics.timed_db
+async def get_guild_member_states(guild_id):
+    query = "SELECT member_id, left_at IS NOT NULL AS left FROM birthdays WHERE guild_id = $1"
+    async with acquire() as conn:
+        rows = await conn.fetch(query, guild_id)
+    return {r["member_id"]: r["left"] for r in rows}
+
+# Suppression définitive, par lots de `batch_size` lignes (verrous courts) :
+# membres partis depuis plus de member_days jours, serveurs quittés depuis plus de guild_days jours,
+# historique du traitement quotidien de plus de run_days jours.
+# Retourne {"members": n, "guilds": n, "runs": n}.
+@metrics.timed_db
+async def purge_departed(member_days, guild_days, run_days, batch_size=1000):
+    purged = {"members": 0, "guilds": 0, "runs": 0}
+    async with acquire() as conn:
+        guild_ids = [r["guild_id"] for r in await conn.fetch(
+            "SELECT guild_id FROM departed_guilds WHERE left_at < now() - make_interval(days => $1)", guild_days
+        )]
+        for guild_id in guild_ids:
+            async with conn.transaction():
+                result = await conn.execute("DELETE FROM birthdays WHERE guild_id = $1", guild_id, timeout=BULK_TIMEOUT)
+                purged["members"] += int(result.split()[-1])
+                await conn.execute("DELETE FROM guild_settings WHERE guild_id = $1", guild_id)
+                await conn.execute("DELETE FROM birthday_runs WHERE guild_id = $1", guild_id)
+                await conn.execute("DELETE FROM departed_guilds WHERE guild_id = $1", guild_id)
+            purged["guilds"] += 1
+
+        batches = {
+            "members": """
+            DELETE FROM birthdays WHERE ctid = ANY(ARRAY(
+                SELECT ctid FROM birthdays
+                WHERE left_at < now() - make_interval(days => $1)
+                -- Serveurs quittés : purgés en entier après GUILD_RETENTION_DAYS (ci-dessus)
+                AND NOT EXISTS (SELECT 1 FROM departed_guilds d WHERE d.guild_id = birthdays.guild_id)
+                LIMIT $2
+            ))
+            """,
+            "runs": """
+            DELETE FROM birthday_runs WHERE ctid = ANY(ARRAY(
+                SELECT ctid FROM birthday_runs WHERE run_date < current_date - $1::INT LIMIT $2
+            ))
+            """,
+        }
+        for key, query in batches.items():
+            days = member_days if key == "members" else run_days
+            while True:
+                result = await conn.execute(query, days, batch_size, timeout=BULK_TIMEOUT)
+                count = int(result.split()[-1])
+                purged[key] += count
+                if count < batch_size:
+                    break
+    return purged
+
+
+# --- Sessions du dashboard (voir sessions.py) ---
+# Données d'une session non expirée, ou None
+@metrics.timed_db
+async def load_web_session(session_id):
+    async with acquire() as conn:
+        data = await run_hot(conn, "load_web_session", "fetchval", session_id)
+    return json.loads(data) if data is not None else None
+
+@metrics.timed_db
+async def save_web_session(session_id, data, expires_at):
+    query = """
+    INSERT INTO web_sessions (id, data, expires_at)
+    VALUES ($1, $2::JSONB, $3)
+    ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+    """
+    async with acquire() as conn:
+        await conn.execute(query, session_id, json.dumps(data), expires_at, timeout=QUERY_TIMEOUT)
+
+@metrics.timed_db
+async def delete_web_session(session_id):
+    async with acquire() as conn:
+        await conn.execute("DELETE FROM web_sessions WHERE id = $1", session_id, timeout=QUERY_TIMEOUT)
+
+# Suppression des sessions expirées ; retourne le nombre de sessions supprimées
+@metrics.timed_db
+async def purge_web_sessions():
+    async with acquire() as conn:
+        result = await conn.execute("DELETE FROM web_sessions WHERE expires_at <= now()", timeout=BULK_TIMEOUT)
+    return int(result.split()[-1])
@@ -0,0 +1,94 @@
+# dispatcher.py
+# Exécution concurrente des actions Discord par serveur, avec un nombre borné de workers.
+# Les actions d'un même serveur restent exécutées dans l'ordre ; les serveurs différents
+# avancent en parallèle. Les buckets par route sont gérés par le client HTTP de discord.py
+# (verrou par bucket + attente préventive), on se contente de limiter la concurrence globale.
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+DEFAULT_CONCURRENCY = int(os.getenv("BIRTHDAY_CONCURRENCY", "10"))
+
+# Compteur du run en cours, hérité par les tâches des workers (les autres tâches du bot n'en ont pas)
+_current_counter = contextvars.ContextVar("rate_limit_counter", default=None)
+
+
+class RateLimitCounter(logging.Handler):
+    """Compte les 429 signalés par le client HTTP de discord.py pendant un run du dispatcher.
+
+    Le logger discord.http est global : seuls les messages émis depuis les tâches du run sont comptés.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        if _current_counter.get() is self and str(record.msg).startswith("We are being rate limited"):
+            self.count += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class GuildDispatcher:
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.jobs = {}  # {guild_id: [coroutine_factory, ...]}
+        self.durations = {}  # {guild_id: secondes}
+
+    def submit(self, guild_id, job):
+        """Ajoute une action (fonction async sans argument) à la file du serveur."""
+        self.jobs.setdefault(guild_id, []).append(job)
+
+    async def _run_guild(self, guild_id):
+        t0 = time.perf_counter()
+        for job in self.jobs[guild_id]:
+            try:
+                await job()
+            except Exception as e:
+                print(f"Erreur lors d'une action sur le serveur {guild_id}: {e}", flush=True)
+        self.durations[guild_id] = time.perf_counter() - t0
+
+    async def _worker(self, queue):
+        while True:
+            try:
+                guild_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._run_guild(guild_id)
+
+    async def run(self):
+        """Exécute toutes les files et retourne les statistiques du run."""
+        queue = asyncio.Queue()
+        for guild_id in self.jobs:
+            queue.put_nowait(guild_id)
+
+        counter = RateLimitCounter()
+        http_logger = logging.getLogger("discord.http")
+        http_logger.addHandler(counter)
+        token = _current_counter.set(counter)
+
+        t0 = time.perf_counter()
+        try:
+            workers = min(self.concurrency, len(self.jobs))
+            await asyncio.gather(*(self._worker(queue) for _ in range(workers)))
+        finally:
+            _current_counter.reset(token)
+            http_logger.removeHandler(counter)
+
+        durations = list(self.durations.values())
+        return {
+            "guilds": len(self.jobs),
+            "total": time.perf_counter() - t0,
+            "p50": percentile(durations, 50),
+            "p99": percentile(durations, 99),
+            "rate_limited": counter.count,
+        }
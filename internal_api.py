@@ -0,0 +1,97 @@
+# internal_api.py
+# API HTTP interne du bot, destinée au dashboard : rôles, salons et membres servis depuis le cache
+# de la gateway, sans appel à l'API REST de Discord ni consommation de ses limites de débit.
+# Format des réponses : sous-ensemble des objets renvoyés par l'API REST (identifiants en chaînes).
+# Une réponse 404 signifie « pas dans ce cache » (serveur géré par un autre process, membres non
+# chargés en mode LOW_MEMORY...) : le dashboard se replie alors sur l'API REST.
+# GET /health (sans jeton) : sonde de vivacité du bot (gateway et base de données).
+# POST /guilds/<id>/roles/reconcile lance une réconciliation du rôle d'anniversaire (bouton du dashboard).
+import hmac
+
+from aiohttp import web
+
+import database as db
+
+
+def create_app(bot, token, complete_guild_list=True, reconcile=None):
+    """complete_guild_list : False si ce process ne voit qu'une partie des serveurs (sharding multi-process).
+    reconcile : coroutine(guild_id) réconciliant le rôle d'anniversaire (None si le serveur n'est pas géré ici).
+    """
+
+    @web.middleware
+    async def check_token(request, handler):
+        if request.path == '/health':
+            return await handler(request)
+        provided = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(provided, token):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        return await handler(request)
+
+    def get_guild(request):
+        guild = bot.get_guild(int(request.match_info['guild_id']))
+        if not guild:
+            raise web.HTTPNotFound()
+        return guild
+
+    async def health(request):
+        status = {"gateway": bot.is_ready() and not bot.is_closed(), "database": await db.ping()}
+        return web.json_response(status, status=200 if all(status.values()) else 503)
+
+    async def guilds(request):
+        if not complete_guild_list or not bot.is_ready():
+            raise web.HTTPNotFound()
+        return web.json_response([{"id": str(g.id), "name": g.name} for g in bot.guilds])
+
+    async def guild(request):
+        g = get_guild(request)
+        return web.json_response({"id": str(g.id), "name": g.name})
+
+    async def roles(request):
+        g = get_guild(request)
+        return web.json_response([
+            {"id": str(r.id), "name": r.name, "position": r.position, "managed": r.managed}
+            for r in g.roles
+        ])
+
+    async def channels(request):
+        g = get_guild(request)
+        return web.json_response([
+            {"id": str(c.id), "name": c.name, "type": c.type.value, "position": c.position}
+            for c in g.channels
+        ])
+
+    async def members(request):
+        g = get_guild(request)
+        # Cache incomplet (chargement en cours, ou LOW_MEMORY) : liste non fiable
+        if not g.chunked:
+            raise web.HTTPNotFound()
+        return web.json_response([
+            {"id": str(m.id), "username": m.name, "avatar": m.avatar.key if m.avatar else None}
+            for m in g.members if not m.bot
+        ])
+
+    async def reconcile_roles(request):
+        if reconcile is None:
+            raise web.HTTPNotFound()
+        result = await reconcile(int(request.match_info['guild_id']))
+        if result is None:
+            raise web.HTTPNotFound()
+        return web.json_response(result, status=409 if 'error' in result else 200)
+
+    app = web.Application(middlewares=[check_token])
+    app.router.add_get('/health', health)
+    app.router.add_get('/guilds', guilds)
+    app.router.add_get('/guilds/{guild_id:\\d+}', guild)
+    app.router.add_get('/guilds/{guild_id:\\d+}/roles', roles)
+    app.router.add_get('/guilds/{guild_id:\\d+}/channels', channels)
+    app.router.add_get('/guilds/{guild_id:\\d+}/members', members)
+    app.router.add_post('/guilds/{guild_id:\\d+}/roles/reconcile', reconcile_roles)
+    return app
+
+
+async def start(bot, port, token, complete_guild_list=True, reconcile=None):
+    runner = web.AppRunner(create_app(bot, token, complete_guild_list, reconcile), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"API interne du bot exposée sur le port {port}.", flush=True)
+    return runner
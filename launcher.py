@@ -0,0 +1,70 @@
+# launcher.py
+# Lance plusieurs process bot.py, chacun avec une plage de shards, et les relance s'ils s'arrêtent.
+#
+# Usage :
+#   python launcher.py --shards 16 --processes 4
+#
+# Pour répartir sur plusieurs conteneurs, lancer directement bot.py avec SHARD_COUNT / SHARD_IDS
+# (ex : SHARD_COUNT=16 SHARD_IDS=0-3 pour le premier conteneur, 4-7 pour le second...).
+#
+# Chaque process expose ses métriques (BOT_METRICS_PORT) et son API interne (BOT_INTERNAL_PORT) sur
+# le port de base + son index. Le dashboard (BOT_INTERNAL_URL) n'interroge qu'un seul de ces process :
+# pour les serveurs des autres shards, il se replie sur l'API REST de Discord.
+import argparse
+import asyncio
+import os
+import sys
+
+RESTART_DELAY = 5
+
+
+def shard_ranges(shard_count, processes):
+    """Découpe [0, shard_count) en `processes` plages contiguës de tailles équilibrées."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end - 1))
+        start = end
+    return ranges
+
+
+async def run_process(index, shard_count, shard_range, metrics_port, internal_port=0):
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = f"{shard_range[0]}-{shard_range[1]}"
+    env["BOT_METRICS_PORT"] = str(metrics_port + index)
+    if internal_port:
+        env["BOT_INTERNAL_PORT"] = str(internal_port + index)
+    # Les commandes slash ne sont synchronisées que par le premier process
+    if index > 0:
+        env["SYNC_COMMANDS"] = "0"
+
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    while True:
+        print(f"[launcher] Démarrage du process {index} (shards {env['SHARD_IDS']}/{shard_count})", flush=True)
+        process = await asyncio.create_subprocess_exec(sys.executable, "-u", bot_path, env=env)
+        code = await process.wait()
+        print(f"[launcher] Process {index} arrêté (code {code}), redémarrage dans {RESTART_DELAY}s...", flush=True)
+        await asyncio.sleep(RESTART_DELAY)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARD_COUNT", "1")))
+    parser.add_argument("--processes", type=int, default=int(os.getenv("BOT_PROCESSES", "1")))
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("BOT_METRICS_PORT", "9100")))
+    parser.add_argument("--internal-port", type=int, default=int(os.getenv("BOT_INTERNAL_PORT", "0")))
+    args = parser.parse_args()
+
+    ranges = shard_ranges(args.shards, args.processes)
+    await asyncio.gather(*(
+        run_process(i, args.shards, shard_range, args.metrics_port, args.internal_port)
+        for i, shard_range in enumerate(ranges)
+    ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+# members.py
+# Résolution des membres d'un serveur, avec ou sans cache des membres.
+# En mode LOW_MEMORY=1, le bot ne garde aucun membre en cache : les membres utiles (anniversaires
+# du jour, page affichée...) sont demandés à la gateway par lots de 100 identifiants.
+import asyncio
+import os
+
+LOW_MEMORY = os.getenv("LOW_MEMORY", "0") == "1"
+QUERY_BATCH_SIZE = 100  # maximum accepté par Discord pour une requête de membres
+
+
+async def resolve_members(guild, member_ids):
+    """Retourne {member_id: Member} pour les membres encore présents sur le serveur."""
+    found = {}
+    missing = []
+    for member_id in member_ids:
+        member = guild.get_member(member_id)
+        if member:
+            found[member_id] = member
+        else:
+            missing.append(member_id)
+
+    # Avec le cache complet, un membre absent du cache a quitté le serveur
+    if not LOW_MEMORY or not missing:
+        return found
+
+    for i in range(0, len(missing), QUERY_BATCH_SIZE):
+        batch = missing[i:i + QUERY_BATCH_SIZE]
+        try:
+            members = await guild.query_members(user_ids=batch, limit=QUERY_BATCH_SIZE, cache=False)
+        except asyncio.TimeoutError:
+            print(f"Délai dépassé lors de la récupération de {len(batch)} membres sur le serveur {guild.id}.", flush=True)
+            continue
+        found.update({m.id: m for m in members})
+    return found
@@ -0,0 +1,116 @@
+# metrics.py
+# Métriques Prometheus partagées par le bot et le dashboard.
+# Désactivées par défaut (METRICS_ENABLED=1 pour les activer) : les décorateurs renvoient alors
+# la fonction d'origine et les context managers ne font rien, le coût est quasi nul.
+# Dashboard avec plusieurs workers (serve.py) : PROMETHEUS_MULTIPROC_DIR, défini avant le lancement
+# des workers, leur fait écrire leurs valeurs dans ce répertoire ; /metrics agrège alors tous les workers.
+import os
+import re
+import time
+from contextlib import asynccontextmanager, nullcontext
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, start_http_server,
+)
+
+ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+DB_QUERY_SECONDS = Histogram(
+    "birthdaybot_db_query_seconds", "Durée des fonctions du module database", ["function"]
+)
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "birthdaybot_db_pool_acquire_seconds", "Attente pour obtenir une connexion du pool"
+)
+DB_POOL_IN_USE = Gauge(
+    "birthdaybot_db_pool_connections_in_use", "Connexions du pool actuellement utilisées",
+    multiprocess_mode="livesum",  # somme des workers encore en vie
+)
+DISCORD_API_SECONDS = Histogram(
+    "birthdaybot_discord_api_seconds", "Durée des appels à l'API Discord", ["process", "endpoint"]
+)
+DISCORD_RATE_LIMITED = Counter(
+    "birthdaybot_discord_rate_limited_total", "Réponses 429 de l'API Discord", ["process"]
+)
+BIRTHDAY_RUN_SECONDS = Histogram(
+    "birthdaybot_birthday_run_seconds", "Durée d'un traitement quotidien des anniversaires",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+BIRTHDAY_GUILDS_PROCESSED = Counter(
+    "birthdaybot_birthday_guilds_processed_total", "Serveurs traités par le traitement quotidien"
+)
+BIRTHDAY_MEMBERS_PROCESSED = Counter(
+    "birthdaybot_birthday_members_processed_total", "Membres traités par le traitement quotidien", ["action"]
+)
+
+_ID_PATTERN = re.compile(r"/\d+")
+
+
+def timed_db(func):
+    """Chronomètre une fonction async du module database (no-op si désactivé)."""
+    if not ENABLED:
+        return func
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        with histogram.time():
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+@asynccontextmanager
+async def timed_acquire(pool):
+    t0 = time.perf_counter()
+    async with pool.acquire() as conn:
+        DB_POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - t0)
+        DB_POOL_IN_USE.inc()
+        try:
+            yield conn
+        finally:
+            DB_POOL_IN_USE.dec()
+
+
+def discord_call(process, endpoint):
+    """Chronomètre un appel Discord ; les identifiants de l'endpoint sont remplacés par {id}."""
+    if not ENABLED:
+        return nullcontext()
+    return DISCORD_API_SECONDS.labels(process, _ID_PATTERN.sub("/{id}", endpoint)).time()
+
+
+def rate_limited(process, count=1):
+    if ENABLED and count:
+        DISCORD_RATE_LIMITED.labels(process).inc(count)
+
+
+def birthday_run(duration, guilds, members_by_action):
+    if not ENABLED:
+        return
+    BIRTHDAY_RUN_SECONDS.observe(duration)
+    BIRTHDAY_GUILDS_PROCESSED.inc(guilds)
+    for action, count in members_by_action.items():
+        BIRTHDAY_MEMBERS_PROCESSED.labels(action).inc(count)
+
+
+def start_exporter(port):
+    """Exporteur HTTP autonome (process du bot)."""
+    if ENABLED:
+        start_http_server(port)
+        print(f"Métriques exposées sur le port {port}.", flush=True)
+
+
+def render():
+    """Corps et type de contenu de la réponse /metrics (tous les workers en mode multi-process)."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Arrêt d'un worker : ses jauges ne sont plus comptées (ses compteurs restent dans le total)."""
+    if ENABLED and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
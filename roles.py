@@ -0,0 +1,80 @@
+# roles.py
+# Réconciliation du rôle d'anniversaire : les détenteurs voulus (anniversaires du jour) sont comparés aux
+# détenteurs actuels, et seuls les ajouts et retraits nécessaires sont envoyés à Discord.
+# Un rôle resté en place (jour manqué, erreur, attribution manuelle...) est donc retiré au passage suivant.
+import asyncio
+import os
+
+import metrics
+from members import LOW_MEMORY, resolve_members
+
+ROLE_CONCURRENCY = int(os.getenv("ROLE_CONCURRENCY", "5"))  # appels simultanés par serveur
+
+
+async def snapshot(guild, role, desired_ids, candidate_ids, full_scan):
+    """({member_id: Member} des détenteurs actuels, {member_id: Member} des membres voulus encore présents)."""
+    if full_scan and LOW_MEMORY:
+        # Sans cache, seul un parcours complet des membres (1 appel par tranche de 1000) donne tous les détenteurs
+        holders = {}
+        desired = {}
+        async for member in guild.fetch_members(limit=None):
+            if role in member.roles:
+                holders[member.id] = member
+            if member.id in desired_ids:
+                desired[member.id] = member
+        return holders, desired
+
+    if LOW_MEMORY:
+        # role.members est vide : les détenteurs sont cherchés parmi les membres fêtés récemment
+        members = await resolve_members(guild, list(desired_ids | set(candidate_ids)))
+        holders = {member_id: m for member_id, m in members.items() if role in m.roles}
+        desired = {member_id: m for member_id, m in members.items() if member_id in desired_ids}
+        return holders, desired
+
+    holders = {m.id: m for m in role.members}
+    desired = await resolve_members(guild, list(desired_ids))
+    return holders, desired
+
+
+async def reconcile_role(guild, role, desired_ids, candidate_ids=(), full_scan=False):
+    """Aligne les détenteurs de `role` sur desired_ids.
+
+    candidate_ids : anciens détenteurs possibles, utilisés en mode LOW_MEMORY (anniversaires des jours précédents).
+    full_scan : en mode LOW_MEMORY, parcourt tous les membres du serveur pour trouver les détenteurs.
+    Retourne {"added": n, "removed": n, "failed": n}.
+    """
+    desired_ids = set(desired_ids)
+    holders, desired = await snapshot(guild, role, desired_ids, candidate_ids, full_scan)
+
+    to_add = [m for member_id, m in desired.items() if member_id not in holders]
+    to_remove = [m for member_id, m in holders.items() if member_id not in desired_ids]
+    if not to_add and not to_remove:
+        return {"added": 0, "removed": 0, "failed": 0}
+
+    semaphore = asyncio.Semaphore(ROLE_CONCURRENCY)
+
+    async def apply(member, add):
+        async with semaphore:
+            if add:
+                with metrics.discord_call('bot', 'add_roles'):
+                    await member.add_roles(role, reason="Anniversaire")
+            else:
+                with metrics.discord_call('bot', 'remove_roles'):
+                    await member.remove_roles(role, reason="Fin de l'anniversaire")
+
+    results = await asyncio.gather(
+        *(apply(m, True) for m in to_add),
+        *(apply(m, False) for m in to_remove),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    for error in errors[:3]:
+        print(f"Erreur lors de la mise à jour du rôle '{role.name}' sur le serveur {guild.name}: {error}", flush=True)
+
+    added = sum(1 for r in results[:len(to_add)] if not isinstance(r, Exception))
+    removed = sum(1 for r in results[len(to_add):] if not isinstance(r, Exception))
+    print(
+        f"Rôle '{role.name}' sur le serveur {guild.name} : {added} ajout(s), {removed} retrait(s), {len(errors)} échec(s).",
+        flush=True
+    )
+    return {"added": added, "removed": removed, "failed": len(errors)}
@@ -0,0 +1,79 @@
+# serve.py
+# Lancement du dashboard en production : serveur ASGI Hypercorn avec plusieurs process (workers).
+# Chaque worker a son propre pool PostgreSQL : WEB_DB_CONNECTIONS (total pour le service web) est
+# réparti entre les workers, pour rester sous max_connections quel que soit le nombre de workers.
+# DB_POOL_MAX_SIZE, s'il est défini, fixe directement la taille du pool de chaque worker.
+# Avec METRICS_ENABLED=1, les workers partagent leurs métriques via PROMETHEUS_MULTIPROC_DIR
+# (répertoire temporaire par défaut, vidé au démarrage) : /metrics renvoie le total de tous les workers.
+#
+# Usage :
+#   python serve.py                       # WEB_WORKERS, WEB_PORT
+#   python serve.py --workers 4 --port 5000
+import argparse
+import glob
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+
+from hypercorn.config import Config
+from hypercorn.run import run
+
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '2'))
+WEB_PORT = int(os.getenv('WEB_PORT', '5000'))
+WEB_DB_CONNECTIONS = int(os.getenv('WEB_DB_CONNECTIONS', '20'))
+GRACEFUL_TIMEOUT = float(os.getenv('WEB_GRACEFUL_TIMEOUT', '10'))
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+
+
+def prepare_metrics_dir():
+    """Répertoire des métriques multi-process ; retourne le répertoire créé ici (à supprimer à l'arrêt)."""
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        # Fichiers d'un lancement précédent : leurs compteurs s'ajouteraient aux nouveaux
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+        return None
+    directory = tempfile.mkdtemp(prefix='birthdaybot-metrics-')
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = directory
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    # Les workers sont lancés avec spawn : ils héritent de l'environnement et database.py le lit à l'import
+    if 'DB_POOL_MAX_SIZE' not in os.environ:
+        os.environ['DB_POOL_MAX_SIZE'] = str(max(2, WEB_DB_CONNECTIONS // workers))
+    os.environ.setdefault('DB_POOL_MIN_SIZE', '1')
+    if not os.getenv('SECRET_KEY'):
+        # Une clé commune à tous les workers (sinon une session n'est reconnue que par le worker qui l'a créée)
+        print("SECRET_KEY non défini : clé aléatoire partagée par les workers, les sessions seront perdues au redémarrage.", flush=True)
+        os.environ['SECRET_KEY'] = secrets.token_hex(32)
+    print(f"Dashboard : {workers} worker(s) sur le port {args.port}, pool PostgreSQL de {os.environ['DB_POOL_MAX_SIZE']} connexions par worker.", flush=True)
+
+    # Avant le lancement des workers : prometheus_client lit la variable à l'import
+    metrics_dir = prepare_metrics_dir() if METRICS_ENABLED else None
+
+    config = Config()
+    config.application_path = "app:app"
+    config.bind = [f"0.0.0.0:{args.port}"]
+    config.workers = workers
+    config.graceful_timeout = GRACEFUL_TIMEOUT
+    config.accesslog = None
+    try:
+        code = run(config)
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# sessions.py
+# Sessions du dashboard stockées dans PostgreSQL (table web_sessions) : le cookie ne contient qu'un
+# identifiant signé avec SECRET_KEY. Les sessions survivent aux redémarrages et sont partagées entre
+# les workers ; la déconnexion supprime la session côté serveur.
+import secrets
+from datetime import datetime, timezone
+
+from itsdangerous import BadSignature, Signer
+from quart.sessions import SecureCookieSession, SessionInterface
+
+import database as db
+
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid  # None : session pas encore enregistrée
+
+
+class PostgresSessionInterface(SessionInterface):
+    """skip_prefixes : chemins servis sans session (fichiers statiques, sondes, métriques)."""
+    salt = "web-session"
+    session_class = ServerSession
+
+    def __init__(self, skip_prefixes=()):
+        self.skip_prefixes = tuple(skip_prefixes)
+
+    def get_signer(self, app):
+        # SECRET_KEY_FALLBACKS : anciennes clés encore acceptées pendant une rotation
+        keys = [*app.config["SECRET_KEY_FALLBACKS"], app.secret_key]
+        return Signer(keys, salt=self.salt)
+
+    async def open_session(self, app, request):
+        # Session nulle (lecture seule, vide) : chemins sans session, ou base pas encore connectée
+        if not app.secret_key or request.path.startswith(self.skip_prefixes) or db.pool is None:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self.session_class()
+        try:
+            sid = self.get_signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return self.session_class()
+        try:
+            data = await db.load_web_session(sid)
+        except Exception as e:
+            print(f"Lecture de la session impossible : {e}", flush=True)
+            return None
+        if data is None:
+            return self.session_class()
+        return self.session_class(data, sid=sid)
+
+    async def save_session(self, app, session, response):
+        if response is None or self.is_null_session(session):
+            return
+        name = self.get_cookie_name(app)
+        cookie_options = dict(
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            httponly=self.get_cookie_httponly(app),
+        )
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified:
+                if session.sid:
+                    await db.delete_web_session(session.sid)
+                response.delete_cookie(name, **cookie_options)
+            return
+
+        if not session.modified:
+            return
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        expires = datetime.now(timezone.utc) + app.permanent_session_lifetime
+        await db.save_web_session(session.sid, dict(session), expires)
+        cookie = self.get_signer(app).sign(session.sid).decode()
+        response.set_cookie(name, cookie, expires=expires, **cookie_options)
+
+
+async def regenerate(session):
+    """Nouvel identifiant à la connexion (un identifiant connu avant la connexion ne donne pas accès au compte)."""
+    if session.sid:
+        await db.delete_web_session(session.sid)
+    session.sid = None
+    session.modified = True
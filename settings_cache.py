@@ -0,0 +1,73 @@
+# settings_cache.py
+# Cache mémoire des paramètres des serveurs, côté bot.
+# Le dashboard notifie chaque modification (NOTIFY guild_settings_changed, voir db.update_guild_settings) :
+# l'entrée du serveur est invalidée dès la réception, sans délai d'expiration.
+# Tant que l'écoute n'est pas active, le cache est contourné et chaque lecture interroge la base.
+import asyncio
+
+import database as db
+
+RECONNECT_DELAY = 5
+
+_settings = {}  # {guild_id: paramètres, ou None si le serveur n'a pas de paramètres}
+_listening = False
+_listener = None
+_generation = 0  # incrémenté à chaque invalidation
+
+
+def _on_notify(payload):
+    global _generation
+    _generation += 1
+    try:
+        _settings.pop(int(payload), None)
+    except ValueError:
+        print(f"Notification de paramètres invalide ignorée : {payload!r}", flush=True)
+
+
+def _on_lost():
+    global _listening, _generation
+    _generation += 1
+    # Des notifications ont pu être manquées : plus aucune entrée n'est fiable
+    _listening = False
+    _settings.clear()
+    print("Écoute des paramètres perdue, reconnexion...", flush=True)
+    asyncio.get_running_loop().create_task(start())
+
+
+async def start():
+    """Ouvre la connexion d'écoute, en réessayant jusqu'au succès."""
+    global _listening, _listener, _generation
+    while True:
+        try:
+            _listener = await db.listen(db.SETTINGS_CHANNEL, _on_notify, _on_lost)
+            break
+        except Exception as e:
+            print(f"Écoute des paramètres impossible, retry dans {RECONNECT_DELAY}s... Erreur: {e}", flush=True)
+            await asyncio.sleep(RECONNECT_DELAY)
+    # Les modifications faites avant l'ouverture de l'écoute n'ont pas été notifiées
+    _generation += 1
+    _settings.clear()
+    _listening = True
+    print("Écoute des modifications de paramètres active.", flush=True)
+
+
+async def get_many(guild_ids):
+    """Équivalent de db.get_guild_settings_many : seuls les serveurs absents du cache sont lus en base."""
+    guild_ids = set(guild_ids)
+    missing = [guild_id for guild_id in guild_ids if guild_id not in _settings]
+    if not _listening:
+        return await db.get_guild_settings_many(guild_ids)
+    if missing:
+        generation = _generation
+        loaded = await db.get_guild_settings_many(missing)
+        # Une invalidation reçue pendant la lecture peut concerner ces serveurs : résultat non mis en cache
+        if generation != _generation:
+            return await db.get_guild_settings_many(guild_ids)
+        for guild_id in missing:
+            _settings[guild_id] = loaded.get(guild_id)
+    return {guild_id: _settings[guild_id] for guild_id in guild_ids if _settings.get(guild_id)}
+
+
+async def get(guild_id):
+    """Équivalent de db.get_guild_settings."""
+    return (await get_many([guild_id])).get(guild_id)
@@ -0,0 +1,5 @@
+# Les modules du projet sont à la racine du dépôt (pas de paquet installable)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,71 @@
+# tests/test_app_batch.py
+import asyncio
+from datetime import date
+
+import pytest
+
+import app as web_app
+
+GUILD_ID = 42
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    calls = []
+
+    async def guild_admin_status(guild_id):
+        return 200
+
+    async def apply_birthday_changes(guild_id, upserts, deletes):
+        calls.append((guild_id, sorted(upserts), sorted(deletes)))
+        return len(upserts), len(deletes)
+
+    monkeypatch.setattr(web_app, "guild_admin_status", guild_admin_status)
+    monkeypatch.setattr(web_app.db, "apply_birthday_changes", apply_birthday_changes)
+    monkeypatch.setattr(web_app.db, "pool", object())
+    return calls
+
+
+def post_batch(body):
+    async def main():
+        client = web_app.app.test_client()
+        response = await client.post(f"/api/guild/{GUILD_ID}/birthdays/batch", json=body)
+        return response.status_code, await response.get_json()
+
+    return asyncio.run(main())
+
+
+def test_last_change_per_member_wins(applied):
+    status, result = post_batch({"changes": [
+        {"member_id": "1", "birthday_date": "2000-01-01"},
+        {"member_id": "2", "birthday_date": "2001-02-02"},
+        {"member_id": "1", "birthday_date": "2000-03-03"},
+        {"member_id": "2", "birthday_date": ""},
+        {"member_id": 3, "birthday_date": None},
+    ]})
+    assert status == 200
+    assert result == {"success": True, "updated": 1, "deleted": 2}
+    assert applied == [(GUILD_ID, [(1, date(2000, 3, 3))], [2, 3])]
+
+
+@pytest.mark.parametrize("change", [
+    {"birthday_date": "2000-01-01"},
+    {"member_id": "abc", "birthday_date": "2000-01-01"},
+    {"member_id": "1", "birthday_date": "01/01/2000"},
+    {"member_id": "1", "birthday_date": "2000-02-30"},
+    "1,2000-01-01",
+])
+def test_invalid_change_rejects_the_whole_batch(applied, change):
+    status, result = post_batch({"changes": [{"member_id": "5", "birthday_date": "2000-01-01"}, change]})
+    assert status == 400
+    assert result["details"][0].startswith("Modification 2 invalide")
+    assert applied == []
+
+
+def test_empty_and_oversized_batches(applied, monkeypatch):
+    assert post_batch({"changes": []})[0] == 400
+    assert post_batch({})[0] == 400
+    monkeypatch.setattr(web_app, "BATCH_MAX_CHANGES", 2)
+    changes = [{"member_id": str(i), "birthday_date": "2000-01-01"} for i in range(3)]
+    assert post_batch({"changes": changes})[0] == 413
+    assert applied == []
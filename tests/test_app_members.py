@@ -0,0 +1,95 @@
+# tests/test_app_members.py
+import asyncio
+from datetime import date
+
+import pytest
+
+import app as web_app
+from cache import AsyncTTLCache
+
+GUILD_ID = 42
+BIRTHDAYS = [(1, date(2000, 1, 1)), (2, date(2001, 2, 2)), (9, date(1999, 9, 9))]
+
+
+@pytest.fixture
+def members_api(monkeypatch):
+    state = {"members_delay": 0, "members_error": None, "member_loads": 0, "birthday_pages": 0}
+
+    async def guild_admin_status(guild_id):
+        return 200
+
+    async def get_guild_members(guild_id):
+        state["member_loads"] += 1
+        await asyncio.sleep(state["members_delay"])
+        if state["members_error"]:
+            raise state["members_error"]
+        return [{"id": "1", "username": "alice", "avatar": None}, {"id": "3", "username": "bob", "avatar": None}]
+
+    async def get_guild_birthdays_page(guild_id, after=0, limit=5000):
+        state["birthday_pages"] += 1
+        return [row for row in BIRTHDAYS if row[0] > after][:limit]
+
+    monkeypatch.setattr(web_app, "guild_admin_status", guild_admin_status)
+    monkeypatch.setattr(web_app, "get_guild_members", get_guild_members)
+    monkeypatch.setattr(web_app.db, "get_guild_birthdays_page", get_guild_birthdays_page)
+    monkeypatch.setattr(web_app.db, "pool", object())
+    monkeypatch.setattr(web_app, "discord_cache", AsyncTTLCache(ttl=60, maxsize=16))
+    monkeypatch.setattr(web_app, "birthdays_listening", True)
+    monkeypatch.setattr(web_app, "BIRTHDAYS_PAGE_SIZE", 2)
+    monkeypatch.setattr(web_app, "MEMBERS_LOAD_TIMEOUT", 0.05)
+    return state
+
+
+async def get_members(**params):
+    client = web_app.app.test_client()
+    response = await client.get(f"/api/guild/{GUILD_ID}/members", query_string=params)
+    return response.status_code, await response.get_json()
+
+
+def test_members_merged_with_paged_birthdays(members_api):
+    status, result = asyncio.run(get_members())
+    assert status == 200
+    assert not result["degraded"]
+    assert [(m["id"], m["birthday"], m["left"]) for m in result["members"]] == [
+        ("1", "2000-01-01", False), ("3", None, False), ("2", "2001-02-02", True), ("9", "1999-09-09", True),
+    ]
+    # Pages de 2 : la dernière page incomplète termine la lecture
+    assert members_api["birthday_pages"] == 2
+
+
+def test_merged_list_cached_until_notified(members_api):
+    async def main():
+        await get_members()
+        await get_members(filter="with")
+        loads = members_api["member_loads"]
+        web_app.on_birthdays_notify(str(GUILD_ID))
+        await get_members()
+        return loads
+
+    assert asyncio.run(main()) == 1
+    assert members_api["member_loads"] == 2
+
+
+def test_failed_member_list_falls_back_to_birthdays(members_api):
+    members_api["members_error"] = OSError("Discord injoignable")
+    status, result = asyncio.run(get_members())
+    assert status == 200
+    assert result["degraded"]
+    assert {m["id"] for m in result["members"]} == {"1", "2", "9"}
+    assert all(m["left"] is None for m in result["members"])
+
+
+def test_slow_member_list_served_degraded_then_cached(members_api):
+    members_api["members_delay"] = 0.2
+
+    async def main():
+        first = await get_members()
+        await asyncio.sleep(0.3)  # le chargement se termine en arrière-plan
+        second = await get_members()
+        return first, second
+
+    (_, first), (_, second) = asyncio.run(main())
+    assert first["degraded"]
+    assert not second["degraded"]
+    assert second["total"] == 4
+    assert members_api["member_loads"] == 1
@@ -0,0 +1,126 @@
+# tests/test_cache.py
+import asyncio
+
+from cache import AsyncTTLCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "valeur"
+
+    async def main():
+        cache = AsyncTTLCache(ttl=60, maxsize=10)
+        results = await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(5)))
+        return cache, results
+
+    cache, results = run(main())
+    assert results == ["valeur"] * 5
+    assert len(calls) == 1
+    assert cache.get_or_fetch  # le cache reste utilisable
+    assert cache.stats()["size"] == 1
+
+
+def test_hit_after_fetch_and_expiry():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        cache = AsyncTTLCache(ttl=0.05, maxsize=10)
+        first = await cache.get_or_fetch("k", fetch)
+        second = await cache.get_or_fetch("k", fetch)
+        await asyncio.sleep(0.06)
+        third = await cache.get_or_fetch("k", fetch)
+        return first, second, third
+
+    assert run(main()) == (1, 1, 2)
+
+
+def test_lru_eviction():
+    async def main():
+        cache = AsyncTTLCache(ttl=60, maxsize=2)
+        for key in ("a", "b", "c"):
+            await cache.get_or_fetch(key, lambda key=key: asyncio.sleep(0, result=key))
+        return list(cache.entries)
+
+    assert run(main()) == ["b", "c"]
+
+
+def test_invalidation_during_fetch_discards_stale_value():
+    source = {"value": "ancienne"}
+
+    async def fetch():
+        value = source["value"]
+        await asyncio.sleep(0.05)
+        return value
+
+    async def main():
+        cache = AsyncTTLCache(ttl=60, maxsize=10)
+        stale = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0.01)
+        source["value"] = "nouvelle"
+        cache.invalidate("k")
+        # L'appelant déjà en attente reçoit l'ancienne valeur...
+        assert await stale == "ancienne"
+        # ...mais elle n'est pas en cache : l'appel suivant relit la source
+        assert await cache.get_or_fetch("k", fetch) == "nouvelle"
+        assert await cache.get_or_fetch("k", fetch) == "nouvelle"
+        return cache
+
+    cache = run(main())
+    assert cache.inflight == {}
+
+
+def test_stale_fetch_finishing_after_newer_fetch_is_ignored():
+    source = {"value": "ancienne", "delay": 0.08}
+
+    async def fetch():
+        value, delay = source["value"], source["delay"]
+        await asyncio.sleep(delay)
+        return value
+
+    async def main():
+        cache = AsyncTTLCache(ttl=60, maxsize=10)
+        slow = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0.01)
+        cache.invalidate_where(lambda key: key == "k")
+        source.update(value="nouvelle", delay=0.01)
+        assert await cache.get_or_fetch("k", fetch) == "nouvelle"
+        await slow  # se termine après le chargement récent
+        return cache
+
+    cache = run(main())
+    assert cache.entries["k"][1] == "nouvelle"
+    assert cache.inflight == {}
+
+
+def test_failed_fetch_is_not_cached():
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("Discord injoignable")
+        return "ok"
+
+    async def main():
+        cache = AsyncTTLCache(ttl=60, maxsize=10)
+        try:
+            await cache.get_or_fetch("k", fetch)
+        except OSError:
+            pass
+        return await cache.get_or_fetch("k", fetch), cache
+
+    value, cache = run(main())
+    assert value == "ok"
+    assert cache.inflight == {}
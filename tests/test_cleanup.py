@@ -0,0 +1,171 @@
+# tests/test_cleanup.py
+import asyncio
+
+import pytest
+
+import cleanup
+from cleanup import MembershipChanges, find_departures, in_shards
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    state = {"left": [], "returned": [], "fail": 0, "guilds_left": [], "guilds_returned": []}
+
+    async def mark_members_left(pairs):
+        if state["fail"]:
+            state["fail"] -= 1
+            raise OSError("base indisponible")
+        state["left"].append(sorted(pairs))
+        return len(pairs)
+
+    async def mark_members_returned(pairs):
+        state["returned"].append(sorted(pairs))
+        return len(pairs)
+
+    async def mark_guild_left(guild_id):
+        state["guilds_left"].append(guild_id)
+
+    async def mark_guild_returned(guild_id):
+        state["guilds_returned"].append(guild_id)
+        return True
+
+    monkeypatch.setattr(cleanup.db, "mark_members_left", mark_members_left)
+    monkeypatch.setattr(cleanup.db, "mark_members_returned", mark_members_returned)
+    monkeypatch.setattr(cleanup.db, "mark_guild_left", mark_guild_left)
+    monkeypatch.setattr(cleanup.db, "mark_guild_returned", mark_guild_returned)
+    return state
+
+
+def test_in_shards():
+    guild_id = 5 << 22  # shard 5 sur 8, shard 1 sur 4
+    assert in_shards(guild_id, None)
+    assert in_shards(guild_id, ([4, 5], 8))
+    assert not in_shards(guild_id, ([0, 1, 2, 3], 8))
+    assert in_shards(guild_id, ([1], 4))
+
+
+def test_changes_are_batched_after_the_delay(fake_db):
+    async def main():
+        changes = MembershipChanges(delay=0.02, batch_size=100)
+        changes.member_left(1, 10)
+        changes.member_left(1, 11)
+        changes.member_returned(2, 20)
+        assert fake_db["left"] == []
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert fake_db["left"] == [[(1, 10), (1, 11)]]
+    assert fake_db["returned"] == [[(2, 20)]]
+
+
+def test_full_batch_is_sent_immediately(fake_db):
+    async def main():
+        changes = MembershipChanges(delay=60, batch_size=2)
+        changes.member_left(1, 10)
+        changes.member_left(1, 11)
+        await asyncio.sleep(0.01)
+        for task in changes._tasks:
+            task.cancel()
+
+    asyncio.run(main())
+    assert fake_db["left"] == [[(1, 10), (1, 11)]]
+
+
+def test_latest_event_wins(fake_db):
+    async def main():
+        changes = MembershipChanges(delay=60)
+        changes.member_left(1, 10)
+        changes.member_returned(1, 10)
+        changes.member_returned(1, 11)
+        changes.member_left(1, 11)
+        await changes.flush()
+
+    asyncio.run(main())
+    assert fake_db["left"] == [[(1, 11)]]
+    assert fake_db["returned"] == [[(1, 10)]]
+
+
+def test_failed_flush_keeps_changes_without_overriding_newer_events(fake_db):
+    fake_db["fail"] = 1
+
+    async def main():
+        changes = MembershipChanges(delay=60)
+        changes.member_left(1, 10)
+        changes.member_left(1, 11)
+        with pytest.raises(OSError):
+            await changes.flush()
+        # Reçu après l'échec : plus récent que le lot
+        changes.member_returned(1, 11)
+        await changes.flush()
+        return changes
+
+    changes = asyncio.run(main())
+    assert fake_db["left"] == [[(1, 10)]]
+    assert fake_db["returned"] == [[(1, 11)]]
+    assert not changes.left and not changes.returned
+
+
+def test_forget_guild_drops_its_pending_changes(fake_db):
+    async def main():
+        changes = MembershipChanges(delay=60)
+        changes.member_left(1, 10)
+        changes.member_left(2, 20)
+        changes.forget_guild(1)
+        await changes.flush()
+
+    asyncio.run(main())
+    assert fake_db["left"] == [[(2, 20)]]
+
+
+class FakeGuild:
+    def __init__(self, guild_id, member_ids=()):
+        self.id = guild_id
+        self.chunked = True
+        self.member_ids = set(member_ids)
+
+    def get_member(self, member_id):
+        return object() if member_id in self.member_ids else None
+
+
+class FakeBot:
+    def __init__(self, guilds):
+        self.guilds = guilds
+
+    def get_guild(self, guild_id):
+        return next((g for g in self.guilds if g.id == guild_id), None)
+
+
+def test_find_departures(fake_db, monkeypatch):
+    async def get_departed_guild_ids():
+        return [3]
+
+    async def get_known_guild_ids():
+        return [1, 2, 4]
+
+    async def get_guild_member_states(guild_id):
+        # {member_id: parti}
+        return {10: False, 11: True, 12: False} if guild_id == 1 else {}
+
+    monkeypatch.setattr(cleanup.db, "get_departed_guild_ids", get_departed_guild_ids)
+    monkeypatch.setattr(cleanup.db, "get_known_guild_ids", get_known_guild_ids)
+    monkeypatch.setattr(cleanup.db, "get_guild_member_states", get_guild_member_states)
+
+    bot = FakeBot([FakeGuild(1, [10, 11]), FakeGuild(3), FakeGuild(4)])
+    asyncio.run(find_departures(bot, MembershipChanges(delay=60)))
+    assert fake_db["guilds_returned"] == [3]
+    assert fake_db["guilds_left"] == [2]
+    assert fake_db["left"] == [[(1, 12)]]
+    assert fake_db["returned"] == [[(1, 11)]]
+
+
+def test_find_departures_ignores_a_mostly_empty_guild_list(fake_db, monkeypatch):
+    async def get_departed_guild_ids():
+        return []
+
+    async def get_known_guild_ids():
+        return [1, 2, 3]
+
+    monkeypatch.setattr(cleanup.db, "get_departed_guild_ids", get_departed_guild_ids)
+    monkeypatch.setattr(cleanup.db, "get_known_guild_ids", get_known_guild_ids)
+    asyncio.run(find_departures(FakeBot([FakeGuild(1)]), MembershipChanges(delay=60), members_cached=False))
+    assert fake_db["guilds_left"] == []
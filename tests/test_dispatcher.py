@@ -0,0 +1,74 @@
+# tests/test_dispatcher.py
+import asyncio
+import logging
+
+from dispatcher import GuildDispatcher, percentile
+
+http_logger = logging.getLogger("discord.http")
+
+
+def rate_limited():
+    http_logger.warning("We are being rate limited. %s %s responded with 429.", "PUT", "/roles")
+
+
+def test_guild_jobs_run_in_order():
+    order = []
+    dispatcher = GuildDispatcher(concurrency=3)
+    for guild_id in (1, 2):
+        for step in range(3):
+            async def job(guild_id=guild_id, step=step):
+                await asyncio.sleep(0)
+                order.append((guild_id, step))
+            dispatcher.submit(guild_id, job)
+
+    stats = asyncio.run(dispatcher.run())
+    assert stats["guilds"] == 2
+    assert [step for guild_id, step in order if guild_id == 1] == [0, 1, 2]
+    assert [step for guild_id, step in order if guild_id == 2] == [0, 1, 2]
+
+
+def test_failing_job_does_not_stop_the_guild():
+    done = []
+
+    async def fail():
+        raise RuntimeError("salon supprimé")
+
+    async def ok():
+        done.append(1)
+
+    dispatcher = GuildDispatcher()
+    dispatcher.submit(1, fail)
+    dispatcher.submit(1, ok)
+    asyncio.run(dispatcher.run())
+    assert done == [1]
+
+
+def test_only_429s_from_the_run_are_counted():
+    async def main():
+        release = asyncio.Event()
+
+        async def other_task():
+            # Tâche du bot étrangère au run : ses 429 ne sont pas comptés
+            await release.wait()
+            rate_limited()
+
+        async def job():
+            rate_limited()
+            release.set()
+            await asyncio.sleep(0.01)
+
+        outside = asyncio.create_task(other_task())
+        dispatcher = GuildDispatcher()
+        dispatcher.submit(1, job)
+        dispatcher.submit(2, job)
+        stats = await dispatcher.run()
+        await outside
+        return stats
+
+    assert asyncio.run(main())["rate_limited"] == 2
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(101)), 99) == 99
@@ -0,0 +1,59 @@
+# tests/test_launcher.py
+import asyncio
+
+import launcher
+from bot import parse_shard_ids
+from launcher import shard_ranges
+
+
+def test_parse_shard_ids():
+    assert parse_shard_ids("0-3") == [0, 1, 2, 3]
+    assert parse_shard_ids("0, 2,5-6") == [0, 2, 5, 6]
+    assert parse_shard_ids("4") == [4]
+    assert parse_shard_ids("") is None
+
+
+def test_shard_ranges_round_trip_through_shard_ids():
+    for start, end in shard_ranges(16, 3):
+        assert parse_shard_ids(f"{start}-{end}") == list(range(start, end + 1))
+
+
+def test_shard_ranges_cover_every_shard_once():
+    for shard_count in range(1, 20):
+        for processes in range(1, 8):
+            ranges = shard_ranges(shard_count, processes)
+            shards = [s for start, end in ranges for s in range(start, end + 1)]
+            assert shards == list(range(shard_count))
+            sizes = [end - start + 1 for start, end in ranges]
+            assert max(sizes) - min(sizes) <= 1
+
+
+def test_shard_ranges_never_more_processes_than_shards():
+    assert shard_ranges(2, 4) == [(0, 0), (1, 1)]
+    assert shard_ranges(10, 3) == [(0, 3), (4, 6), (7, 9)]
+
+
+def test_each_process_gets_its_own_ports(monkeypatch):
+    envs = []
+
+    class Stop(Exception):
+        pass
+
+    async def fake_exec(*args, env):
+        envs.append(env)
+        raise Stop
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", fake_exec)
+
+    async def main():
+        for index, shard_range in enumerate(shard_ranges(4, 2)):
+            try:
+                await launcher.run_process(index, 4, shard_range, 9100, 8081)
+            except Stop:
+                pass
+
+    asyncio.run(main())
+    assert [env["SHARD_IDS"] for env in envs] == ["0-1", "2-3"]
+    assert [env["BOT_METRICS_PORT"] for env in envs] == ["9100", "9101"]
+    assert [env["BOT_INTERNAL_PORT"] for env in envs] == ["8081", "8082"]
+    assert envs[1]["SYNC_COMMANDS"] == "0"
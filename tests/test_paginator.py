@@ -0,0 +1,85 @@
+# tests/test_paginator.py
+import asyncio
+import re
+from datetime import date
+
+import pytest
+
+import BirthdayPaginator as paginator
+from BirthdayPaginator import BirthdayPageButton, cursor_of
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    state = {"total": 3, "reads": 0}
+
+    async def count_guild_birthdays(guild_id):
+        state["reads"] += 1
+        return state["total"]
+
+    async def get_upcoming_birthdays_page(guild_id, today, after=None, before=None, limit=15):
+        return [{"member_id": i, "birthday_date": date(2000, 1, 1), "birthday_key": 101, "wrapped": False}
+                for i in range(state["total"])]
+
+    monkeypatch.setattr(paginator.db, "count_guild_birthdays", count_guild_birthdays)
+    monkeypatch.setattr(paginator.db, "get_upcoming_birthdays_page", get_upcoming_birthdays_page)
+    monkeypatch.setattr(paginator, "page_cache", paginator.AsyncTTLCache(ttl=60, maxsize=16))
+    monkeypatch.setattr(paginator, "_listening", True)
+    return state
+
+
+def test_cursor_survives_the_custom_id():
+    today = date(2026, 3, 14)
+    entry = {"member_id": 123456789012345678, "birthday_key": 1231, "wrapped": True}
+    button = BirthdayPageButton("next", 42, 3, today, cursor_of(entry))
+
+    match = re.fullmatch(BirthdayPageButton.__discord_ui_compiled_template__, button.item.custom_id)
+    decoded = asyncio.run(BirthdayPageButton.from_custom_id(None, button.item, match))
+    assert (decoded.direction, decoded.guild_id, decoded.page, decoded.today) == ("next", 42, 3, today)
+    assert decoded.cursor == (True, 1231, 123456789012345678)
+    assert len(button.item.custom_id) <= 100  # limite de Discord
+
+
+def test_previous_page_from_first_page_stays_at_zero():
+    button = BirthdayPageButton("prev", 42, -1, date(2026, 1, 1), (False, 0, 0), disabled=True)
+    assert button.page == 0
+    assert ":prev:42:0:20260101:" in button.item.custom_id
+
+
+def test_count_and_page_are_cached_together(fake_db):
+    async def main():
+        first = await paginator.fetch_page(1, date(2026, 1, 1))
+        fake_db["total"] = 5
+        second = await paginator.fetch_page(1, date(2026, 1, 1))
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second
+    assert first[0] == len(first[1]) == 3
+    assert fake_db["reads"] == 1
+
+
+def test_notification_invalidates_only_that_guild(fake_db):
+    async def main():
+        today = date(2026, 1, 1)
+        await paginator.fetch_page(1, today)
+        await paginator.fetch_page(2, today)
+        fake_db["total"] = 5
+        paginator._on_notify("1")
+        paginator._on_notify("pas un identifiant")
+        return await paginator.fetch_page(1, today), await paginator.fetch_page(2, today)
+
+    guild_1, guild_2 = asyncio.run(main())
+    assert guild_1[0] == 5
+    assert guild_2[0] == 3
+
+
+def test_cache_bypassed_until_listening(fake_db, monkeypatch):
+    monkeypatch.setattr(paginator, "_listening", False)
+
+    async def main():
+        await paginator.fetch_page(1, date(2026, 1, 1))
+        fake_db["total"] = 4
+        return await paginator.fetch_page(1, date(2026, 1, 1))
+
+    assert asyncio.run(main())[0] == 4
@@ -0,0 +1,161 @@
+# tests/test_scheduler.py
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+
+import bot
+import database as db
+from bot import pending_runs
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_midnight_passed_only_in_eastern_timezones():
+    # 22h30 UTC le 14/03 : déjà le 15/03 à Tokyo, encore le 14/03 à Paris et New York
+    now = utc(2026, 3, 14, 22, 30)
+    cursors = {"Asia/Tokyo": date(2026, 3, 14), "Europe/Paris": date(2026, 3, 14), "America/New_York": date(2026, 3, 14)}
+    assert pending_runs(now, list(cursors), cursors) == {(date(2026, 3, 15), True): ["Asia/Tokyo"]}
+
+
+def test_missed_days_are_caught_up_before_today():
+    now = utc(2026, 3, 14, 12, 0)
+    pending = pending_runs(now, ["Europe/Paris"], {"Europe/Paris": date(2026, 3, 11)})
+    assert pending == {
+        (date(2026, 3, 12), False): ["Europe/Paris"],
+        (date(2026, 3, 13), False): ["Europe/Paris"],
+        (date(2026, 3, 14), True): ["Europe/Paris"],
+    }
+
+
+def test_catch_up_is_bounded():
+    now = utc(2026, 3, 14, 12, 0)
+    pending = pending_runs(now, ["UTC"], {"UTC": date(2025, 1, 1)})
+    assert min(run_date for run_date, _ in pending) == date(2026, 3, 14) - timedelta(days=bot.CATCH_UP_DAYS)
+    assert (date(2026, 3, 14), True) in pending
+
+
+def test_timezone_without_cursor_is_celebrated_today():
+    now = utc(2026, 3, 14, 12, 0)
+    assert pending_runs(now, ["Europe/Paris"], {}) == {(date(2026, 3, 14), True): ["Europe/Paris"]}
+
+
+def test_unknown_timezone_is_skipped():
+    now = utc(2026, 3, 14, 12, 0)
+    assert pending_runs(now, ["Mars/Olympus_Mons"], {}) == {}
+
+
+def test_up_to_date_timezone_has_nothing_pending():
+    now = utc(2026, 3, 14, 12, 0)
+    assert pending_runs(now, ["UTC"], {"UTC": date(2026, 3, 14)}) == {}
+
+
+def test_new_shard_starts_from_the_earliest_cursor(monkeypatch):
+    rows = [
+        # Fuseau déjà traité par tous les shards demandés
+        {"timezone": "UTC", "own_run_date": date(2026, 3, 13), "own_shards": 2, "earliest_run_date": date(2026, 3, 10)},
+        # Un des shards demandés n'a pas encore de curseur
+        {"timezone": "Europe/Paris", "own_run_date": date(2026, 3, 14), "own_shards": 1, "earliest_run_date": date(2026, 3, 12)},
+    ]
+
+    class FakeConn:
+        async def fetch(self, query, shard_ids):
+            assert shard_ids == [4, 5]
+            return rows
+
+    @asynccontextmanager
+    async def acquire():
+        yield FakeConn()
+
+    monkeypatch.setattr(db, "acquire", acquire)
+    cursors = asyncio.run(db.get_schedule_cursors([5, 4, 4]))
+    assert cursors == {"UTC": date(2026, 3, 13), "Europe/Paris": date(2026, 3, 12)}
+
+
+class FakeChannel:
+    def __init__(self, fail):
+        self.fail = fail
+        self.sent = []
+
+    async def send(self, message):
+        if self.fail:
+            raise OSError("Discord injoignable")
+        self.sent.append(message)
+
+
+class FakeMember:
+    def __init__(self, member_id):
+        self.mention = f"<@{member_id}>"
+
+
+class FakeGuild:
+    def __init__(self, channel):
+        self.name = "Serveur"
+        self.channel = channel
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+
+def fake_announcement(monkeypatch, fail):
+    calls = []
+    channel = FakeChannel(fail)
+
+    async def claim_announcement(guild_id, run_date, retry_delay):
+        calls.append(("claim", guild_id))
+        return True
+
+    async def mark_birthday_run(guild_id, run_date, *steps):
+        calls.append(("mark", guild_id, steps))
+
+    async def resolve_members(guild, member_ids):
+        return {member_id: FakeMember(member_id) for member_id in member_ids}
+
+    monkeypatch.setattr(db, "claim_announcement", claim_announcement)
+    monkeypatch.setattr(db, "mark_birthday_run", mark_birthday_run)
+    monkeypatch.setattr(bot, "resolve_members", resolve_members)
+    monkeypatch.setattr(bot.bot, "get_guild", lambda guild_id: FakeGuild(channel))
+    return calls, channel
+
+
+SETTINGS = {"channel_id": 10, "birthday_message": "Joyeux anniversaire @membres !"}
+
+
+def test_announcement_marked_only_after_send(monkeypatch):
+    calls, channel = fake_announcement(monkeypatch, fail=False)
+    asyncio.run(bot.celebrate_guild(1, [7], SETTINGS, date(2026, 3, 14), {}))
+    assert channel.sent == ["Joyeux anniversaire <@7> !"]
+    assert calls == [("claim", 1), ("mark", 1, ("announced",))]
+
+
+def test_failed_announcement_is_left_for_retry(monkeypatch):
+    calls, channel = fake_announcement(monkeypatch, fail=True)
+    asyncio.run(bot.celebrate_guild(1, [7], SETTINGS, date(2026, 3, 14), {}))
+    assert calls == [("claim", 1)]
+
+
+def test_retry_announcements_celebrates_failed_guilds(monkeypatch):
+    calls, channel = fake_announcement(monkeypatch, fail=False)
+    requested = []
+
+    async def get_announcement_retries(run_date, timezones, retry_delay, max_attempts, shards=None):
+        requested.append((run_date, timezones))
+        return [1] if run_date == date(2026, 3, 15) else []
+
+    async def get_guild_birthdays_on_date(guild_id, some_date):
+        return [7, 8]
+
+    async def get_many(guild_ids):
+        return {guild_id: SETTINGS for guild_id in guild_ids}
+
+    monkeypatch.setattr(db, "get_announcement_retries", get_announcement_retries)
+    monkeypatch.setattr(db, "get_guild_birthdays_on_date", get_guild_birthdays_on_date)
+    monkeypatch.setattr(bot.settings_cache, "get_many", get_many)
+
+    by_date = bot.timezones_by_date(utc(2026, 3, 14, 22, 30), ["Asia/Tokyo", "Europe/Paris"])
+    assert by_date == {date(2026, 3, 15): ["Asia/Tokyo"], date(2026, 3, 14): ["Europe/Paris"]}
+    asyncio.run(bot.retry_announcements(by_date))
+    assert len(requested) == 2
+    assert channel.sent == ["Joyeux anniversaire <@7>, <@8> !"]
+    assert calls[-1] == ("mark", 1, ("announced",))